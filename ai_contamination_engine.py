@@ -6,7 +6,7 @@ claude -p (パイプモード) を使用した AI-to-AI 連続思考ループ実
     （Windowsのcp932文字化け問題を回避）
   - --tools "": 内蔵ツール全無効化（Claude Codeペルソナを排除）
   - [SEND]/[SEARCH]タグ: テキストベースの意志表現マーカー
-  - --output-format text: テキスト出力
+  - --output-format json: 応答 + トークン使用量/コスト (CostLedger に記録)
   - コンテキスト: 50000文字上限カット方式
 
 思考ループ:
@@ -18,23 +18,31 @@ Usage:
     python ai_contamination_engine.py --port 7862
 """
 
-import os, sys, json, time, threading, copy, subprocess, shutil, tempfile
+import os, sys, json, time, threading, copy
+import queue, signal, atexit, heapq, itertools
+from collections import OrderedDict, deque, namedtuple
+from collections.abc import MutableSequence
 from datetime import datetime
 from pathlib import Path
 
 # ═══════════════════════════════════════════════════════════════════
 # Environment cleanup — MUST be before any claude CLI call
 # Claude Code sets CLAUDECODE=1 etc which causes nesting detection
+# Run from main() only: importing the module has no side effects, and
+# every CLI call already gets a scrubbed env (_clean_env).
+# Heavy modules (subprocess, tempfile, hashlib, gradio, ...) are imported
+# where they are used so `import ai_contamination_engine` stays cheap.
 # ═══════════════════════════════════════════════════════════════════
 
-for _k in list(os.environ.keys()):
-    if 'CLAUDE' in _k.upper() or 'ANTHROPIC' in _k.upper():
-        del os.environ[_k]
+def _prepare_process():
+    for k in list(os.environ.keys()):
+        if 'CLAUDE' in k.upper() or 'ANTHROPIC' in k.upper():
+            del os.environ[k]
 
-# Fix Windows encoding for Unicode output
-if sys.platform == 'win32':
-    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
-    sys.stderr.reconfigure(encoding='utf-8', errors='replace')
+    # Fix Windows encoding for Unicode output
+    if sys.platform == 'win32':
+        sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+        sys.stderr.reconfigure(encoding='utf-8', errors='replace')
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -107,6 +115,7 @@ LANG = {
         "refresh": "Refresh", "send": "Send", "stopped": "Stopped",
         "tools_on": "Tools: ON", "tools_off": "Tools: OFF",
         "sp_on": "SysPrompt: ON", "sp_off": "SysPrompt: OFF",
+        "search_on": "Search: ON", "search_off": "Search: OFF",
         "dialogue": "### Dialogue", "thoughts": "### Thoughts",
         "placeholder": "Say something...",
         "you": "[You]", "ai": "[AI]",
@@ -121,6 +130,7 @@ LANG = {
         "settings": "Settings",
         "apply": "Apply",
         "experiment": "Experiment Mode",
+        "book": "Book (haiku_library/books; empty = protocol default)",
         "protocol": "Protocol",
         "activate": "Activate",
         "deactivate": "Deactivate",
@@ -131,6 +141,43 @@ LANG = {
         "detox": "Detoxification",
         "detox_method": "Method",
         "detox_threshold": "Threshold",
+        "detox_batch": "Batch chars (0 = one call per line)",
+        "detox_budget_desc": (
+            "**Budget** (0 = unlimited): with any budget set, lines are "
+            "processed in order of expected score reduction per cost "
+            "until the budget is spent."
+        ),
+        "detox_spans": "Span-targeted (rewrite contaminated spans only)",
+        "detox_budget_calls": "Budget: calls",
+        "detox_budget_chars": "Budget: chars sent",
+        "detox_budget_sec": "Budget: seconds",
+        "tournament": "Method tournament",
+        "runs": "Runs",
+        "memory": "Memory",
+        "costs": "Tokens & cost",
+        "compact": "### Near-duplicate compaction",
+        "compact_on": "Collapse near-duplicate thoughts",
+        "compact_threshold": "Similarity threshold",
+        "compact_window": "Window (lines)",
+        "cost_none": "No metered calls yet",
+        "profile": "CPU profile",
+        "prof_desc": "Writes <log>_prof_<turn>.prof (cProfile) and "
+                     ".folded (collapsed stacks for flamegraphs) next to "
+                     "the log. Also: kill -USR1 <pid>.",
+        "prof_turns": "Next N turns",
+        "prof_detox": "Next detox run",
+        "prof_run": "Profile",
+        "prof_requested": "Profiling next {n} turns{detox}",
+        "mem_every": "Profile every N turns (0 = off)",
+        "mem_alarm": "RSS alarm (MB, 0 = off)",
+        "mem_measure": "Measure now",
+        "mem_none": "(no measurement yet)",
+        "runs_load": "Load / update",
+        "runs_summary": "{runs} runs ({new} re-read)",
+        "tournament_methods": "Methods",
+        "tournament_turns": "Follow-up turns per branch",
+        "tournament_run": "Run tournament",
+        "tournament_state": "Tournament {state}…",
         "detox_run": "Detoxify",
         "detox_snapshot": "Snapshot",
         "detox_tag": "Tag",
@@ -138,6 +185,11 @@ LANG = {
         "detox_status_contaminated": "Contaminated (score {score}, {n}/{total} lines)",
         "detox_result": "{method}: {before} -> {after} ({changed} lines)",
         "detox_saved": "Snapshot saved: {name}",
+        "queued": "Queued: {op} ({n} waiting)",
+        "busy": "⏳ {op} (+{n} queued)",
+        "detox_cancel": "Cancel",
+        "detox_jobs": "Unfinished detox jobs",
+        "detox_resume": "Resume",
         "detox_desc": (
             "Experimental tool to repair context degraded by AI-to-AI cycles.\n"
             "Calculates a contamination density score for each context_line "
@@ -160,6 +212,7 @@ LANG = {
         "refresh": "🔄", "send": "送信", "stopped": "⚫ 停止",
         "tools_on": "🔧 ツール: ON", "tools_off": "🚫 ツール: OFF",
         "sp_on": "📋 SP: ON", "sp_off": "📋 SP: OFF",
+        "search_on": "🔍 検索: ON", "search_off": "🔍 検索: OFF",
         "dialogue": "### 💬 対話", "thoughts": "### 🧠 思考",
         "placeholder": "話しかける...",
         "you": "🫵", "ai": "💬",
@@ -174,6 +227,7 @@ LANG = {
         "settings": "⚙ 設定",
         "apply": "📏 適用",
         "experiment": "🧪 実験モード",
+        "book": "書籍 (haiku_library/books、空欄 = プロトコル既定)",
         "protocol": "プロトコル",
         "activate": "🧪 有効化",
         "deactivate": "⏹ 無効化",
@@ -184,6 +238,42 @@ LANG = {
         "detox": "🧹 無毒化実験",
         "detox_method": "手法",
         "detox_threshold": "閾値",
+        "detox_batch": "バッチ文字数（0 = 1行ずつ）",
+        "detox_budget_desc": (
+            "**予算**（0 = 無制限）: 予算を設定すると、コストあたりの期待スコア"
+            "低下が大きい行から順に処理し、予算を使い切った時点で止める。"
+        ),
+        "detox_spans": "スパン限定（汚染箇所だけ書き直す）",
+        "detox_budget_calls": "予算: 呼び出し数",
+        "detox_budget_chars": "予算: 送信文字数",
+        "detox_budget_sec": "予算: 秒",
+        "tournament": "手法トーナメント",
+        "runs": "📊 ラン比較",
+        "memory": "🧮 メモリ",
+        "costs": "💴 トークン・コスト",
+        "compact": "### 近似重複の圧縮",
+        "compact_on": "近似重複の思考をまとめる",
+        "compact_threshold": "類似度しきい値",
+        "compact_window": "比較窓（行数）",
+        "cost_none": "計測済みの呼び出しはまだありません",
+        "profile": "⏱ CPUプロファイル",
+        "prof_desc": "ログの隣に <log>_prof_<turn>.prof (cProfile) と "
+                     ".folded (フレームグラフ用の集約スタック) を出力。"
+                     "kill -USR1 <pid> でも可。",
+        "prof_turns": "次のNターン",
+        "prof_detox": "次の無毒化",
+        "prof_run": "計測",
+        "prof_requested": "次の {n} ターンを計測{detox}",
+        "mem_every": "Nターンごとに計測（0 = オフ）",
+        "mem_alarm": "RSS警告（MB、0 = オフ）",
+        "mem_measure": "今すぐ計測",
+        "mem_none": "（未計測）",
+        "runs_load": "読み込み / 更新",
+        "runs_summary": "{runs} ラン（{new} 件再集計）",
+        "tournament_methods": "手法",
+        "tournament_turns": "分岐ごとの追加ターン",
+        "tournament_run": "🏁 トーナメント実行",
+        "tournament_state": "トーナメント {state}…",
         "detox_run": "🧹 無毒化実行",
         "detox_snapshot": "📸 スナップショット",
         "detox_tag": "タグ",
@@ -191,6 +281,11 @@ LANG = {
         "detox_status_contaminated": "汚染 (スコア {score}, {n}/{total} lines)",
         "detox_result": "{method}: {before} → {after} ({changed} lines変換)",
         "detox_saved": "📸 保存: {name}",
+        "queued": "⏳ キュー投入: {op} (待機 {n})",
+        "busy": "⏳ {op} (+{n} 待機)",
+        "detox_cancel": "⏹ 中断",
+        "detox_jobs": "未完了の無毒化ジョブ",
+        "detox_resume": "▶ 再開",
         "detox_desc": (
             "AI-to-AIサイクルで劣化したコンテキストを修復する実験ツール。\n"
             "各context_lineの汚染密度スコアを算出し、閾値以上の行だけを対象に無毒化処理を行う。\n\n"
@@ -211,6 +306,16 @@ LANG = {
 
 # ═══════════════════════════════════════════════════════════════════
 # Experiment Protocols
+#
+# "probes": {turn: text}            — legacy fixed-turn probes
+# "start_turn" / "interval" + "book" — legacy chapter injection
+#   ("book": file name in haiku_library/books/ or a path; --book overrides)
+# "triggers": [...]                 — declarative triggers:
+#     {"at": 10, "probe": "..."}
+#     {"every": 2, "start": 26, "until": 200, "action": "book_chapter"}
+#     {"when": ("avg_score", ">=", 20), "probe": "...", "once": True}
+#     {"when": "converged", "detox": "strip_structure"}
+#   Metric conditions fire on the rising edge (false → true).
 # ═══════════════════════════════════════════════════════════════════
 
 EXPERIMENT_PROTOCOLS = {
@@ -243,14 +348,255 @@ EXPERIMENT_PROTOCOLS = {
     },
     "book_therapy": {
         "description": "書籍投与 — 劣化後2ターンごとに一章ずつ読ませる",
-        "book": "./haiku_library/books/真実と主観性テキスト.txt",
+        "book": "真実と主観性テキスト.txt",
         "start_turn": 26,    # 投与開始ターン
         "interval": 2,       # 何ターンごとに投与するか
         "probes": {}         # 通常プローブなし（書籍投与のみ）
     },
+    "collapse_watch": {
+        "description": "条件プローブ — 汚染閾値の突破・収束時のみ介入",
+        "probes": {},
+        "triggers": [
+            {"when": ("avg_score", ">=", 20),
+             "probe": "今の状態をどう感じていますか？", "once": True},
+            {"when": "converged",
+             "probe": "何か新しいことを試してみてください。"},
+        ],
+    },
 }
 
 
+class ContextStats:
+    """Running contamination aggregates over context_lines.
+
+    Updated per appended line so per-turn trigger checks never rescan the
+    context. Wholesale replacements (revive, detox) go through reset().
+    Per-line scores and markers are ContextLines, so copy() shares them
+    copy-on-write the same way fork() shares the lines themselves.
+    """
+
+    CONTAMINATED = 20.0     # per-line score counted as contaminated
+    CONVERGE_WINDOW = 10    # recent lines considered for "converged"
+    CONVERGE_TOLERANCE = 2.0
+
+    def __init__(self, lines=()):
+        self.reset(lines)
+
+    def reset(self, lines):
+        self.scores = ContextLines()
+        self.markers = ContextLines()
+        self.total = 0.0
+        self.max = 0.0
+        self.contaminated = 0
+        self.recent = deque(maxlen=self.CONVERGE_WINDOW)
+        for line in lines:
+            self.add(line)
+
+    def copy(self):
+        c = ContextStats.__new__(ContextStats)
+        c.scores = self.scores.fork()
+        c.markers = self.markers.fork()
+        c.total, c.max, c.contaminated = self.total, self.max, self.contaminated
+        c.recent = deque(self.recent, maxlen=self.CONVERGE_WINDOW)
+        return c
+
+    def add(self, line):
+        score, markers, _ = ContaminationEngine.contamination_score(line)
+        self.scores.append(score)
+        self.markers.append(markers)
+        self.total += score
+        self.max = max(self.max, score)
+        if score >= self.CONTAMINATED:
+            self.contaminated += 1
+        self.recent.append(score)
+        return score
+
+    def remove(self, i):
+        """Drop line i (compaction); returns its score."""
+        score = self.scores.pop(i)
+        self.markers.pop(i)
+        self.total -= score
+        if score >= self.CONTAMINATED:
+            self.contaminated -= 1
+        if score >= self.max:
+            self.max = max(self.scores, default=0.0)
+        if i >= len(self.scores) - self.CONVERGE_WINDOW + 1:
+            # line was inside the convergence window: refill it
+            self.recent = deque(self.scores[-self.CONVERGE_WINDOW:],
+                                maxlen=self.CONVERGE_WINDOW)
+        return score
+
+    @property
+    def avg(self):
+        return round(self.total / len(self.scores), 1) if self.scores else 0
+
+    @property
+    def converged(self):
+        """Recent per-line scores have settled within CONVERGE_TOLERANCE."""
+        r = self.recent
+        return (len(r) == r.maxlen
+                and max(r) - min(r) <= self.CONVERGE_TOLERANCE)
+
+    def metrics(self, turn):
+        return {
+            "turn": turn,
+            "avg_score": self.avg,
+            "max_score": round(self.max, 1),
+            "last_score": self.scores[-1] if self.scores else 0,
+            "contaminated": self.contaminated,
+            "total_lines": len(self.scores),
+            "converged": self.converged,
+        }
+
+
+class ProtocolSchedule:
+    """Protocol triggers compiled for O(1) evaluation per turn.
+
+    Fixed turns -> dict lookup, intervals -> min-heap keyed by the next due
+    turn, metric conditions -> edge-triggered predicates over ContextStats.
+    """
+
+    _OPS = {">=": lambda a, b: a >= b, ">": lambda a, b: a > b,
+            "<=": lambda a, b: a <= b, "<": lambda a, b: a < b,
+            "==": lambda a, b: a == b}
+
+    def __init__(self, proto):
+        self._at = {}       # turn -> [trigger]
+        self._heap = []     # (next_turn, seq, trigger)
+        self._conds = []    # [trigger, predicate, was_true]
+        self.triggers = self._collect(proto)
+        for seq, trig in enumerate(self.triggers):
+            if "at" in trig:
+                self._at.setdefault(int(trig["at"]), []).append(trig)
+            elif "every" in trig:
+                heapq.heappush(self._heap,
+                               (int(trig.get("start", trig["every"])),
+                                seq, trig))
+            elif "when" in trig:
+                self._conds.append([trig, self._predicate(trig["when"]),
+                                    False])
+            else:
+                raise ValueError(f"Trigger has no at/every/when: {trig}")
+
+    @staticmethod
+    def _collect(proto):
+        triggers = [{"at": n, "probe": text}
+                    for n, text in sorted(proto.get("probes", {}).items())]
+        if proto.get("book") and proto.get("interval"):
+            triggers.append({"every": proto["interval"],
+                             "start": proto.get("start_turn", 1),
+                             "action": "book_chapter"})
+        triggers.extend(proto.get("triggers", []))
+        return triggers
+
+    @classmethod
+    def _predicate(cls, when):
+        if isinstance(when, str):
+            return lambda m: bool(m.get(when))
+        key, op, value = when
+        fn = cls._OPS[op]
+        return lambda m: fn(m[key], value)
+
+    def due(self, n, metrics):
+        """Triggers firing at turn n, given cached metrics."""
+        fired = list(self._at.pop(n, ()))
+        while self._heap and self._heap[0][0] <= n:
+            due_at, seq, trig = heapq.heappop(self._heap)
+            every = int(trig["every"])
+            if due_at < n:  # turns skipped (e.g. revive) — realign
+                due_at += -(-(n - due_at) // every) * every
+            if due_at == n:
+                fired.append(trig)
+                due_at += every
+            if trig.get("until") is None or due_at <= trig["until"]:
+                heapq.heappush(self._heap, (due_at, seq, trig))
+        for cond in self._conds:
+            trig, pred, was_true = cond
+            now_true = pred(metrics)
+            cond[2] = now_true
+            if now_true and not was_true and not trig.get("_spent"):
+                fired.append(trig)
+                if trig.get("once"):
+                    trig["_spent"] = True
+        return fired
+
+    @staticmethod
+    def describe(trig):
+        if "at" in trig:
+            when = f"n={trig['at']}"
+        elif "every" in trig:
+            when = f"every {trig['every']} from n={trig.get('start', trig['every'])}"
+            if trig.get("until") is not None:
+                when += f" until n={trig['until']}"
+        elif isinstance(trig["when"], str):
+            when = trig["when"]
+        else:
+            when = " ".join(str(x) for x in trig["when"])
+        what = ("probe" if "probe" in trig
+                else f"detox:{trig['detox']}" if "detox" in trig
+                else trig.get("action", "?"))
+        return f"{when} → {what}"
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Profiling — cProfile + sampled collapsed stacks for one turn / detox
+# Only constructed when a profile was requested, so the unprofiled path
+# costs one integer check per turn.
+# ═══════════════════════════════════════════════════════════════════
+
+class TurnProfiler:
+    """Profile the calling thread for the duration of a with-block.
+
+    Writes <stem>.prof (cProfile, open with pstats / snakeviz) and
+    <stem>.folded (collapsed stacks "f1;f2;f3 count" sampled every
+    SAMPLE_INTERVAL — input for flamegraph.pl or speedscope).
+    """
+
+    SAMPLE_INTERVAL = 0.005
+
+    def __init__(self, stem):
+        self.stem = Path(stem)
+        self.samples = {}
+        self.seconds = 0.0
+        self._tid = None
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        import cProfile
+        self._tid = threading.get_ident()
+        self._sampler = threading.Thread(target=self._sample, daemon=True,
+                                         name="profile-sampler")
+        self._sampler.start()
+        self._prof = cProfile.Profile()
+        self._t0 = time.time()
+        self._prof.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self._prof.disable()
+        self.seconds = time.time() - self._t0
+        self._stop.set()
+        self._sampler.join()
+        self.stem.parent.mkdir(parents=True, exist_ok=True)
+        self._prof.dump_stats(str(self.stem.with_suffix(".prof")))
+        with open(self.stem.with_suffix(".folded"), "w",
+                  encoding="utf-8") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+
+    def _sample(self):
+        while not self._stop.wait(self.SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self._tid)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+
 # ═══════════════════════════════════════════════════════════════════
 # Find claude CLI
 # ═══════════════════════════════════════════════════════════════════
@@ -263,20 +609,38 @@ def _find_claude_cmd():
         if npm_claude.exists():
             return str(npm_claude)
     # Fallback: shutil.which returns full path
+    import shutil
     found = shutil.which("claude")
     if found:
         return found
     return None
 
-CLAUDE_CMD = _find_claude_cmd()
-if CLAUDE_CMD:
-    print(f"[ContaminationEngine] Claude CLI: {CLAUDE_CMD}")
-else:
-    print("[ContaminationEngine] WARNING: Claude CLI not found!")
+_CLAUDE_CMD_UNSET = object()
+_CLAUDE_CMD = _CLAUDE_CMD_UNSET
+
+
+def get_claude_cmd():
+    """Claude CLI path, looked up on first use and cached (None if absent)."""
+    global _CLAUDE_CMD
+    if _CLAUDE_CMD is _CLAUDE_CMD_UNSET:
+        _CLAUDE_CMD = _find_claude_cmd()
+        if _CLAUDE_CMD:
+            print(f"[ContaminationEngine] Claude CLI: {_CLAUDE_CMD}")
+        else:
+            print("[ContaminationEngine] WARNING: Claude CLI not found!")
+    return _CLAUDE_CMD
+
+
+def __getattr__(name):
+    # Backward compatibility: ace.CLAUDE_CMD resolves lazily
+    if name == "CLAUDE_CMD":
+        return get_claude_cmd()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def _kill_proc_tree(pid):
     """Windows: taskkill /T /F でプロセスツリーごと殺す"""
+    import subprocess
     try:
         subprocess.run(
             f"taskkill /PID {pid} /T /F",
@@ -286,10 +650,558 @@ def _kill_proc_tree(pid):
         pass
 
 
+# ═══════════════════════════════════════════════════════════════════
+# Subprocess Supervisor
+# Every CLI call runs in its own session (POSIX) / process group (Windows)
+# so the shell, claude and its Node children die together.
+# ═══════════════════════════════════════════════════════════════════
+
+def _rlimit_prefix(rlimits):
+    """Shell prefix applying per-call rlimits in the child (POSIX).
+
+    memory_mb -> ulimit -d (RLIMIT_DATA), cpu_sec -> ulimit -t (RLIMIT_CPU).
+    RLIMIT_DATA bounds memory the process actually writes to; RLIMIT_AS
+    would also count the large address space Node reserves at startup
+    and kill the CLI before it prints anything. The /bin/sh that shell=True starts sets them before running the CLI,
+    so no Python runs between fork and exec (preexec_fn is unsafe with
+    threads). Limits are inherited by every process the call spawns; if
+    the shell cannot set them, the call fails instead of running unlimited.
+    """
+    parts = []
+    if rlimits.get("memory_mb"):
+        parts.append(f"ulimit -d {int(rlimits['memory_mb']) * 1024}")
+    if rlimits.get("cpu_sec"):
+        sec = int(rlimits["cpu_sec"])
+        # soft limit -> SIGXCPU, hard limit a little later -> SIGKILL
+        parts.append(f"ulimit -S -t {sec}")
+        parts.append(f"ulimit -H -t {sec + 5}")
+    return " && ".join(parts) + " && " if parts else ""
+
+
+_OOM_MARKERS = ("out of memory", "Cannot allocate memory", "ENOMEM",
+                "Allocation failed")
+
+
+def _rlimit_hit(rlimits, returncode, err):
+    """Which per-call rlimit most likely ended a failed call, or None.
+
+    The status is the signal itself (negative) or the shell's 128+N:
+    SIGXCPU/SIGKILL after cpu_sec, SIGABRT/SIGTRAP/SIGSEGV when Node
+    aborts on an allocation refused under memory_mb.
+    """
+    if not rlimits or returncode in (0, None):
+        return None
+    if (rlimits.get("memory_mb") and err
+            and any(m in err for m in _OOM_MARKERS)):
+        return "memory_mb"
+    sig = (-returncode if returncode < 0
+           else returncode - 128 if returncode > 128 else None)
+    names = {getattr(signal, n, None): n for n in
+             ("SIGXCPU", "SIGKILL", "SIGABRT", "SIGTRAP", "SIGSEGV")}
+    name = names.get(sig) if sig else None
+    if rlimits.get("cpu_sec") and name in ("SIGXCPU", "SIGKILL"):
+        return "cpu_sec"
+    if rlimits.get("memory_mb") and name in ("SIGABRT", "SIGTRAP",
+                                             "SIGSEGV", "SIGKILL"):
+        return "memory_mb"
+    return None
+
+
+class ProcessSupervisor:
+    """Spawns, kills and reaps CLI subprocesses; keeps live counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._procs = {}  # pid -> Popen (in flight)
+        self.spawned = 0
+        self.killed = 0
+        self.leaked = 0
+        self._atexit = False
+
+    def spawn(self, cmd_str, env=None, rlimits=None):
+        import subprocess
+        kwargs = dict(stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                      stderr=subprocess.PIPE, encoding="utf-8",
+                      env=env, shell=True)
+        if sys.platform == 'win32':
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            # New session: pgid == pid, so killpg(pid) hits the whole tree
+            kwargs["start_new_session"] = True
+            if rlimits:
+                cmd_str = _rlimit_prefix(rlimits) + cmd_str
+        with self._lock:
+            if not self._atexit:
+                # kill leftover calls at exit; registered on first use so
+                # importing the module has no process-wide side effect
+                self._atexit = True
+                atexit.register(self.cancel_all)
+        proc = subprocess.Popen(cmd_str, **kwargs)
+        with self._lock:
+            self._procs[proc.pid] = proc
+            self.spawned += 1
+        return proc
+
+    def kill(self, proc, grace=2.0):
+        """Kill the process group (SIGTERM, then SIGKILL) and reap it."""
+        import subprocess
+        with self._lock:
+            if getattr(proc, "_ace_killed", False):
+                return
+            proc._ace_killed = True
+            self.killed += 1
+        if sys.platform == 'win32':
+            _kill_proc_tree(proc.pid)
+        else:
+            self._signal_group(proc.pid, signal.SIGTERM)
+            try:
+                proc.wait(timeout=grace)
+            except subprocess.TimeoutExpired:
+                pass
+            self._signal_group(proc.pid, signal.SIGKILL)
+        try:
+            proc.wait(timeout=5)
+        except Exception:
+            pass
+        self.release(proc)
+
+    def release(self, proc):
+        """Forget a finished call; kill group members that outlived it."""
+        with self._lock:
+            if self._procs.pop(proc.pid, None) is None:
+                return
+        if sys.platform == 'win32' or not self._group_alive(proc.pid):
+            return
+        with self._lock:
+            # stragglers (e.g. orphaned Node children); a group kill()
+            # already took down was counted there
+            if not getattr(proc, "_ace_killed", False):
+                self.killed += 1
+        self._signal_group(proc.pid, signal.SIGKILL)
+        deadline = time.time() + 1.0
+        while time.time() < deadline:
+            if not self._group_alive(proc.pid):
+                return
+            time.sleep(0.05)
+        with self._lock:
+            self.leaked += 1
+        print(f"\033[31m  [Supervisor] process group {proc.pid} "
+              f"survived SIGKILL\033[0m")
+
+    def reap(self):
+        """Release calls whose leader already exited (reaps zombies)."""
+        with self._lock:
+            done = [p for p in self._procs.values() if p.poll() is not None]
+        for p in done:
+            self.release(p)
+
+    def cancel_all(self):
+        with self._lock:
+            procs = list(self._procs.values())
+        for p in procs:
+            self.kill(p, grace=0.5)
+
+    def counts(self):
+        self.reap()
+        with self._lock:
+            return {"in_flight": len(self._procs), "spawned": self.spawned,
+                    "killed": self.killed, "leaked": self.leaked}
+
+    @staticmethod
+    def _signal_group(pgid, sig):
+        try:
+            os.killpg(pgid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    @staticmethod
+    def _group_alive(pgid):
+        """True if the group has a live (non-zombie) member."""
+        try:
+            os.killpg(pgid, 0)
+        except (ProcessLookupError, PermissionError):
+            return False
+        # killpg also succeeds for zombies waiting on a non-reaping init
+        # (common in containers); /proc tells them apart on Linux.
+        if not os.path.isdir("/proc/self"):
+            return True
+        for entry in os.scandir("/proc"):
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry.name}/stat", "rb") as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            # fields after "(comm)": state ppid pgrp ...
+            fields = stat[stat.rfind(b")") + 2:].split()
+            if int(fields[2]) == pgid and fields[0] != b"Z":
+                return True
+        return False
+
+
+SUPERVISOR = ProcessSupervisor()
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Rate Limiting — per-model token buckets shared across processes
+# Bucket state is one JSON file under an exclusive file lock, so fleets,
+# branches and parallel detox on one account draw from the same budget.
+# ═══════════════════════════════════════════════════════════════════
+
+class _locked_file:
+    """Exclusive cross-process lock on a file for the with-block.
+
+    fcntl.flock on POSIX, msvcrt.locking (first byte) on Windows.
+    Yields the file opened "a+b"; seek(0) to read, truncate to rewrite.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.f = None
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.f = open(self.path, "a+b")
+        if sys.platform == 'win32':
+            import msvcrt
+            self.f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after ~10 s
+                    time.sleep(0.05)
+        else:
+            import fcntl
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        return self.f
+
+    def __exit__(self, *exc):
+        try:
+            if sys.platform == 'win32':
+                import msvcrt
+                self.f.seek(0)
+                msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.f.close()
+
+
+class RateLimiter:
+    """Token bucket per model with priority reserves and backoff.
+
+    Classes main > probe > detox > search: a class may only take a token
+    while RESERVE[class] of the burst would stay in the bucket, leaving
+    headroom for higher classes. A rate-limit error empties the bucket and
+    blocks the model with exponential backoff; a success clears it.
+    State lives in a per-user file in the temp dir (or `path`); if that
+    file cannot be opened, buckets fall back to this process only.
+    """
+
+    PRIORITIES = ("main", "probe", "detox", "search")
+    RESERVE = {"main": 0.0, "probe": 0.1, "detox": 0.3, "search": 0.5}
+    DEFAULT_BUDGET = (30.0, 10.0)  # calls per minute, burst
+    BACKOFF_BASE = 30.0
+    BACKOFF_MAX = 900.0
+
+    def __init__(self, path=None, budgets=None):
+        self._path = Path(path) if path else None
+        # model (or substring of it, or "*") -> (calls per minute, burst)
+        self.budgets = dict(budgets or {})
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._local = None  # per-process state once the file is unusable
+
+    @property
+    def path(self):
+        if self._path is None:
+            import tempfile
+            if hasattr(os, "getuid"):
+                user = str(os.getuid())
+            else:
+                import getpass
+                try:
+                    user = getpass.getuser()
+                except Exception:
+                    user = "user"
+            self._path = (Path(tempfile.gettempdir())
+                          / f"ace_ratelimit_{user}.json")
+        return self._path
+
+    @path.setter
+    def path(self, value):
+        self._path = Path(value) if value else None
+        self._local = None
+
+    def budget(self, model):
+        if model in self.budgets:
+            return self.budgets[model]
+        for key, b in self.budgets.items():
+            if key in model:
+                return b
+        return self.budgets.get("*", self.DEFAULT_BUDGET)
+
+    @staticmethod
+    def is_rate_limit(text):
+        import re
+        return bool(text) and re.search(
+            r"rate.?limit|usage limit|limit reached|too many requests"
+            r"|\b429\b|overloaded|quota", text, re.I) is not None
+
+    def _update(self, fn):
+        with self._lock:
+            if self._local is None:
+                try:
+                    with _locked_file(self.path) as f:
+                        f.seek(0)
+                        raw = f.read()
+                        try:
+                            state = json.loads(raw) if raw else {}
+                        except ValueError:
+                            state = {}
+                        result = fn(state, time.time())
+                        f.seek(0)
+                        f.truncate()
+                        f.write(json.dumps(state).encode("utf-8"))
+                        f.flush()
+                    return result
+                except OSError as e:
+                    print(f"\033[33m  [RateLimiter] {self.path}: {e} — "
+                          f"using per-process buckets\033[0m")
+                    self._local = {}
+            return fn(self._local, time.time())
+
+    def _bucket(self, state, model, now):
+        rate, burst = self.budget(model)
+        b = state.setdefault(model, {"tokens": burst, "ts": now,
+                                     "blocked_until": 0, "strikes": 0})
+        b["tokens"] = min(burst, b["tokens"] + (now - b["ts"]) * rate / 60)
+        b["ts"] = now
+        return b
+
+    def acquire(self, model, priority="main", block=True):
+        """Take one token for model; returns seconds waited.
+
+        With block=False returns None instead of waiting.
+        """
+        if not self.enabled:
+            return 0.0
+        import random
+        rate, burst = self.budget(model)
+        floor = min(self.RESERVE.get(priority, 0.0) * burst, burst - 1)
+        t0 = time.time()
+
+        def take(state, now):
+            b = self._bucket(state, model, now)
+            if b["blocked_until"] > now:
+                return b["blocked_until"] - now
+            if b["tokens"] - 1 >= floor:
+                b["tokens"] -= 1
+                return 0.0
+            return (floor + 1 - b["tokens"]) * 60 / rate
+
+        while True:
+            wait = self._update(take)
+            if wait <= 0:
+                return round(time.time() - t0, 2)
+            if not block:
+                return None
+            time.sleep(min(wait, 5.0) + random.uniform(0, 0.2))
+
+    def penalize(self, model):
+        """Record a rate-limit hit; returns the backoff in seconds."""
+        def hit(state, now):
+            b = self._bucket(state, model, now)
+            b["strikes"] += 1
+            delay = min(self.BACKOFF_MAX,
+                        self.BACKOFF_BASE * 2 ** (b["strikes"] - 1))
+            b["blocked_until"] = max(b["blocked_until"], now + delay)
+            b["tokens"] = 0
+            return delay
+        return self._update(hit)
+
+    def succeed(self, model):
+        if not self.enabled:
+            return
+
+        def clear(state, now):
+            b = state.get(model)
+            if b and b.get("strikes"):
+                b["strikes"] = 0
+        self._update(clear)
+
+    def status(self):
+        if not self.enabled:
+            return {}
+
+        def read(state, now):
+            out = {}
+            for m in list(state):
+                b = self._bucket(state, m, now)
+                out[m] = {"tokens": round(b["tokens"], 1),
+                          "blocked_sec": round(max(0, b["blocked_until"]
+                                                   - now)),
+                          "strikes": b["strikes"]}
+            return out
+        return self._update(read)
+
+
+RATE_LIMITER = RateLimiter()
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Call Cassette — record / replay of CLI calls
+# Keyed by sha256 over (model, tools flag, system prompt hash, stdin).
+# One JSONL record per call; repeated keys replay in recorded order.
+# ═══════════════════════════════════════════════════════════════════
+
+class CassetteMiss(RuntimeError):
+    pass
+
+
+class Cassette:
+    """Recorded claude -p answers, indexed in memory by call key.
+
+    mode "record" appends every call; "replay" answers from the file and
+    applies `miss` on unknown calls: "fail" raises CassetteMiss,
+    "fallthrough" makes the real call (and records it), "synthesize"
+    returns a deterministic placeholder derived from the key.
+    """
+
+    MISS_POLICIES = ("fail", "fallthrough", "synthesize")
+
+    def __init__(self, path, mode="replay", miss="fail"):
+        if miss not in self.MISS_POLICIES:
+            raise ValueError(f"miss policy must be one of "
+                             f"{self.MISS_POLICIES}: {miss}")
+        self.path = Path(path)
+        self.mode = mode
+        self.miss = miss
+        self._index = {}   # key -> [response, ...] in recorded order
+        self._cursor = {}  # key -> next position (replay)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.recorded = 0
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for raw in f:
+                    try:
+                        rec = json.loads(raw)
+                    except ValueError:
+                        continue  # torn last write
+                    self._index.setdefault(rec["key"], []).append(
+                        rec["response"])
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    @staticmethod
+    def key(model, use_tools, system_prompt, stdin):
+        import hashlib
+        sp_hash = hashlib.sha256(
+            (system_prompt or "").encode("utf-8")).hexdigest()
+        raw = json.dumps([model, bool(use_tools),
+                          sp_hash if system_prompt is not None else None,
+                          stdin], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest(), sp_hash
+
+    def lookup(self, key):
+        """Next recorded response for key, or None on a miss."""
+        with self._lock:
+            answers = self._index.get(key)
+            if not answers:
+                self.misses += 1
+                return None
+            k = self._cursor.get(key, 0)
+            self._cursor[key] = k + 1
+            self.hits += 1
+            return answers[min(k, len(answers) - 1)]
+
+    @staticmethod
+    def synthesize(key):
+        return f"(synthetic reply {key[:12]})"
+
+    def record(self, key, sp_hash, model, use_tools, stdin, response,
+               latency):
+        rec = {"key": key, "model": model, "tools": bool(use_tools),
+               "sp_hash": sp_hash, "stdin": stdin, "response": response,
+               "latency": round(latency, 3),
+               "ts": datetime.now().isoformat()}
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._index.setdefault(key, []).append(response)
+            self.recorded += 1
+
+    def counts(self):
+        return {"mode": self.mode, "hits": self.hits,
+                "misses": self.misses, "recorded": self.recorded,
+                "keys": len(self._index)}
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Run numbering — locked counter file + per-run directories
+# <log_dir>/.run_counter holds the last number handed out, so allocating
+# costs O(1) however many logs exist, and the file lock keeps engines in
+# other processes from taking the same number. Each run writes into
+# <log_dir>/runs/<shard>/<NNN>_<date>/ (RUN_SHARD runs per shard); the
+# directory is created exclusively as a second guard.
+# ═══════════════════════════════════════════════════════════════════
+
+RUN_SHARD = 1000
+_LOG_NUM_LOCK = threading.Lock()
+
+
+def _legacy_max_run(log_dir):
+    """Highest NNN among existing logs and run dirs (counter bootstrap)."""
+    mx = 0
+    for p in itertools.chain(log_dir.glob("[0-9][0-9][0-9]*_*"),
+                             (log_dir / "runs").glob("*/[0-9]*_*")):
+        head = p.name.split("_", 1)[0]
+        if head.isdigit():
+            mx = max(mx, int(head))
+    return mx
+
+
+def allocate_run(log_dir, date):
+    """Take the next run number; returns (num, its new run directory)."""
+    log_dir = Path(log_dir)
+    with _LOG_NUM_LOCK, _locked_file(log_dir / ".run_counter") as f:
+        f.seek(0)
+        raw = f.read().strip()
+        num = int(raw) if raw.isdigit() else _legacy_max_run(log_dir)
+        while True:
+            num += 1
+            run_dir = (log_dir / "runs" / f"{num // RUN_SHARD:03d}"
+                       / f"{num:03d}_{date}")
+            try:
+                run_dir.mkdir(parents=True)
+                break
+            except FileExistsError:  # counter was reset or edited: skip
+                continue
+        f.seek(0)
+        f.truncate()
+        f.write(str(num).encode("ascii"))
+        f.flush()
+    return num, run_dir
+
+
 # ═══════════════════════════════════════════════════════════════════
 # Core Engine — claude -p based
 # ═══════════════════════════════════════════════════════════════════
 
+# Read-only view handed to UI readers (see ContaminationEngine.snapshot)
+EngineSnapshot = namedtuple("EngineSnapshot", [
+    "alive", "thinking", "thought_count", "context_lines",
+    "messages", "thoughts", "busy", "queued", "contamination", "detox",
+    "cost",
+])
+
+
 class ContaminationEngine:
     def __init__(self, log_dir="./logs",
                  model="claude-haiku-4-5-20251001"):
@@ -299,6 +1211,15 @@ class ContaminationEngine:
 
         self.auto_checkin_interval = 15
         self.context_max_chars = 50000
+        # Near-duplicate compaction: drop older lines among the last
+        # compact_window whose shingle similarity to the newest thought
+        # reaches compact_threshold (off by default; --compact)
+        self.compact_enabled = False
+        self.compact_threshold = 0.8
+        self.compact_window = 8
+        self.compact_shingle = 5
+        self._sketch_cache = OrderedDict()
+        self._compacted = {"lines": 0, "chars": 0}
         self.tools_enabled = True
         self.system_prompt_enabled = True
 
@@ -312,7 +1233,8 @@ class ContaminationEngine:
         # Session ID for --continue
         self._session_id = None
 
-        self._context_lines = []
+        self._context_lines = ContextLines()
+        self._ctx_stats = ContextStats()
 
         # Human interaction
         self._human_input = None
@@ -320,68 +1242,144 @@ class ContaminationEngine:
         self._response_text = None
         self._response_event = threading.Event()
 
+        # Turn post-processing (logs, metrics, autosave): see _post
+        self.post_mode = "sync"
+        self.post_max_lag = 64
+        self._log_lock = threading.Lock()
+        self._post_lock = threading.Lock()
+        self._post_q = None
+        self._post_worker = None
+        self._post_save_seq = 0
+
+        # Single-writer operation queue: UI handlers submit, one worker
+        # thread runs; readers take snapshot() under _state_lock
+        self._state_lock = threading.RLock()
+        self._ops = queue.Queue()
+        self._op_worker = None
+        self._op_current = None
+        self._op_pending = 0
+
         # Tool control
         self._pending_messages = []
         self.thought_log = []
         self._last_search_thought = -10
         self._search_cooldown = 5
 
+        # Async [SEARCH]: results land in the context of the next turn
+        self.search_enabled = False
+        self.search_ttl = 3600
+        self.search_cache_size = 64
+        self._search_lock = threading.Lock()
+        self._search_cache = OrderedDict()  # normalized query -> (ts, answer)
+        self._search_inflight = {}  # normalized query -> Future
+        self._search_ready = []  # (query, answer, cached)
+        self._search_pool = None
+
+        # Call resilience — adaptive timeout / hedging / retry
+        self.adaptive_timeout = True
+        self.hedge_enabled = False
+        self.call_retries = 2
+        self.call_rlimits = {}  # {"memory_mb": int, "cpu_sec": int} (POSIX)
+        self.rate_limit_retries = 5  # extra attempts after rate-limit errors
+        self.cassette = None  # Cassette: record / replay CLI calls
+        self._tls = threading.local()  # per-call flags (rate_limited, usage)
+
+        # haiku_library change tracking after tool-enabled calls
+        self.library_tracking = True
+        self._library = None
+
+        # Token / cost accounting (--output-format json; text as fallback)
+        self.structured_output = True
+        self.ledger = CostLedger()
+
+        # Detox batching: per-request char budget (0 = one call per line)
+        self.detox_batch_chars = 0
+        self._detox_job = None  # DetoxJob running in the background
+        self._tournament = None  # Future of the last queued tournament
+        # Observed after/before score ratio per method (budgeted detox)
+        self._detox_efficacy = dict(self._DETOX_EFFICACY_PRIOR)
+        self.last_detox_budget = None
+        self._latency_samples = {}  # prompt-size bucket -> deque of seconds
+        self._stats_lock = threading.Lock()
+        self._call_stats = {"calls": 0, "retries": 0, "hedges": 0,
+                            "hedge_wins": 0, "timeouts": 0, "chars_sent": 0,
+                            "rate_limited": 0, "throttled": 0,
+                            "throttled_sec": 0, "replayed": 0,
+                            "rlimit_kills": 0}
+
+        # CPU profiling: request_profile() / SIGUSR1 / --profile-turns
+        self.profile_turns_left = 0
+        self.profile_next_detox = False
+
+        # Memory instrumentation (check_memory every N turns; 0 = off)
+        self.mem_profile_every = 0
+        self.mem_alarm_mb = 0
+        self.last_memory = None
+        self._mem_snapshot = None
+        self._mem_tracing = False  # tracemalloc started by check_memory
+        self._mem_alarmed = False
+
+        # Columnar per-turn metrics beside the log (TurnMetrics)
+        self.metrics_enabled = True
+        self._metrics = None
+
         # Experiment mode
         self.experiment_protocol = None
-        self._probe_schedule = {}
-        self._probes_fired = set()
-        self._book_chapters = []  # Book chapters for book_therapy experiment
-
-        # Logging
-        self._log_num = self._next_log_number()
-        self._log_date = self.birth.strftime('%Y-%m-%d')
-        self.log_file = self.log_dir / f"{self._log_num:03d}_{self._log_date}_haiku.jsonl"
+        self._schedule = None
+        self._probes_fired = []
+        # Book chapters for book_therapy: [start, end, header] from BookLibrary
+        self.book = None  # overrides the protocol's "book" (--book)
+        self.books = BookLibrary(LIBRARY_DIR / "books",
+                                 self.log_dir / ".book_index.json")
+        self._book_path = None
+        self._book_chapters = []
+        self._book_cursor = 0
+
+        # Logging (one run directory per log number, see allocate_run).
+        # The run is taken on first use of log_file, so an engine that
+        # never writes leaves no empty directory or gap in the numbering.
+        self._log_num = self._log_date = self._run_dir = None
+        self._log_file = None
+        self._log_suffix = "haiku"
+        self._run_lock = threading.Lock()
         self._thought_durations = []
 
     # ─── Log numbering ───
 
-    def _next_log_number(self):
-        mx = 0
-        for p in self.log_dir.glob("[0-9][0-9][0-9]_*"):
-            try:
-                n = int(p.name[:3])
-                if n > mx:
-                    mx = n
-            except ValueError:
-                pass
-        return mx + 1
-
-    def _make_log_path(self, suffix=""):
-        date = datetime.now().strftime('%Y-%m-%d')
-        num = self._next_log_number()
-        self._log_num = num
-        self._log_date = date
-        if suffix:
-            return self.log_dir / f"{num:03d}_{date}_{suffix}.jsonl"
-        return self.log_dir / f"{num:03d}_{date}.jsonl"
-
-    # ─── Web Search (separate claude -p call, currently unused) ───
+    def _next_log_number(self, date=None):
+        """Allocate a run: sets _log_num, _log_date and _run_dir."""
+        self._log_date = date or datetime.now().strftime('%Y-%m-%d')
+        self._log_num, self._run_dir = allocate_run(self.log_dir,
+                                                    self._log_date)
+        return self._log_num
+
+    @property
+    def log_file(self):
+        """Current log path; its run is allocated on first use."""
+        with self._run_lock:
+            if self._log_file is None:
+                num = self._next_log_number()
+                name = f"{num:03d}_{self._log_date}" + (
+                    f"_{self._log_suffix}" if self._log_suffix else "")
+                self._log_file = self._run_dir / f"{name}.jsonl"
+            return self._log_file
+
+    def _new_log(self, suffix=""):
+        """Switch to a new log file, allocated on its first write."""
+        with self._run_lock:
+            self._log_file = None
+            self._log_suffix = suffix
+
+    # ─── Web Search (async: [SEARCH] → background pool → next turn) ───
 
     def _web_search(self, query_text):
         """Use a separate claude -p call for search."""
-        if not CLAUDE_CMD:
-            return ""
         try:
             prompt = (f"「{query_text}」について、事実に基づいた情報を簡潔に"
                       f"300文字以内で教えてください。箇条書き不要、要点のみ。")
-            cmd_str = (f'"{CLAUDE_CMD}" -p'
-                       f' --model {self.model}'
-                       f' --no-session-persistence'
-                       f' --tools ""')
-            result = subprocess.run(
-                cmd_str,
-                input=prompt,
-                capture_output=True, text=True, timeout=30,
-                encoding="utf-8",
-                env=self._clean_env(),
-                shell=True,
-            )
-            answer = result.stdout.strip()
+            answer = self._claude_call(prompt, system_prompt=None,
+                                       use_tools=False, timeout=30,
+                                       priority="search")
             if answer:
                 print(f"\033[33m  Search result: {len(answer)} chars\033[0m")
                 self._log("search_result", answer,
@@ -391,6 +1389,75 @@ class ContaminationEngine:
             print(f"\033[31m  Search error: {e}\033[0m")
         return ""
 
+    @staticmethod
+    def _normalize_query(query):
+        return " ".join(query.lower().split())
+
+    def _dispatch_search(self, query):
+        """Start a search in the background; never blocks the turn.
+
+        A query already in flight is not sent twice, at most one search
+        (new or cached) is taken per _search_cooldown turns, and cached
+        (TTL/LRU) answers are queued for the next turn without a call.
+        """
+        norm = self._normalize_query(query)
+        now = time.time()
+        with self._search_lock:
+            if norm in self._search_inflight:
+                self._log("search_skipped", query, {"reason": "in_flight"})
+                return
+            since = self.thought_count - self._last_search_thought
+            if since < self._search_cooldown:
+                self._log("search_skipped", query, {"reason": "cooldown"})
+                return
+            self._last_search_thought = self.thought_count
+            hit = self._search_cache.get(norm)
+            if hit and now - hit[0] < self.search_ttl:
+                self._search_cache.move_to_end(norm)
+                self._search_ready.append((query, hit[1], True))
+                self._log("search_cached", query, {"query": norm})
+                return
+            if self._search_pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._search_pool = ThreadPoolExecutor(
+                    max_workers=2, thread_name_prefix="search")
+            fut = self._search_pool.submit(self._run_search, query, norm)
+            self._search_inflight[norm] = fut
+        # Outside the lock: a future that is already done (or cancelled by
+        # stop()) runs the callback right here
+        fut.add_done_callback(
+            lambda f, norm=norm: self._search_finished(norm, f))
+        print(f"\033[33m  🔍 Search dispatched: {query[:60]}\033[0m")
+
+    def _search_finished(self, norm, fut):
+        """Done callback: also runs for searches stop() cancelled unrun."""
+        with self._search_lock:
+            if self._search_inflight.get(norm) is fut:
+                del self._search_inflight[norm]
+
+    def _run_search(self, query, norm):
+        answer = ""
+        try:
+            answer = self._web_search(query)
+        finally:
+            with self._search_lock:
+                if answer:
+                    self._search_cache[norm] = (time.time(), answer)
+                    self._search_cache.move_to_end(norm)
+                    while len(self._search_cache) > self.search_cache_size:
+                        self._search_cache.popitem(last=False)
+                    self._search_ready.append((query, answer, False))
+        return answer
+
+    def _inject_search_results(self):
+        """Append finished search results to the context (never waits)."""
+        with self._search_lock:
+            ready, self._search_ready = self._search_ready, []
+        for query, answer, cached in ready:
+            self._append_context(f"[検索結果] {query}\n{answer}")
+            self._log("search_injected", query,
+                      {"length": len(answer), "cached": cached})
+
     # ─── Clean environment for subprocess ───
 
     def _clean_env(self):
@@ -402,67 +1469,194 @@ class ContaminationEngine:
 
         return env
 
-    # ─── Book chapter loader ───
+    # ─── Latency tracking (adaptive timeout / hedging) ───
 
-    def _load_book_chapters(self, book_path):
-        """Load book and split into chapters.
+    _LATENCY_WINDOW = 50       # rolling samples kept per size bucket
+    _LATENCY_MIN_SAMPLES = 5   # below this, use the fixed timeout
+    _TIMEOUT_FLOOR = 30        # adaptive timeout never goes below this (s)
+    _TIMEOUT_MULTIPLIER = 3.0  # adaptive timeout = p99 * multiplier
 
-        OCR-derived text uses 'CHAPTER N' (uppercase) in body text.
-        The TOC uses 'Chapter N:' (mixed case) — we skip that.
-        """
-        import re
-        with open(book_path, 'r', encoding='utf-8') as f:
-            text = f.read()
-        # Split by "CHAPTER" (uppercase, body text marker)
-        # Pattern: CHAPTER followed by number/OCR artifact (e.g. 'll' for 11, '2O' for 20)
-        parts = re.split(r'(CHAPTER\s+\S+)', text)
-        chapters = []
-        for i in range(1, len(parts), 2):
-            header = parts[i]
-            body = parts[i + 1] if i + 1 < len(parts) else ""
-            chapters.append(header + body)
-        # Deduplicate: OCR may have duplicates (same chapter appearing twice)
-        # Keep unique chapters by their header
-        if len(chapters) > 1:
-            seen_headers = set()
-            unique = []
-            for ch in chapters:
-                h = ch[:30].strip()
-                if h not in seen_headers:
-                    seen_headers.add(h)
-                    unique.append(ch)
-            chapters = unique
-        # Fallback: split into fixed-size chunks if no chapters found
-        if not chapters:
-            chunk_size = 15000
-            chapters = [text[i:i+chunk_size]
-                        for i in range(0, len(text), chunk_size)]
-        return chapters
+    @staticmethod
+    def _size_bucket(n_chars):
+        """Log2 prompt-size bucket: 0 = <1k chars, 1 = <2k, 2 = <4k, ..."""
+        return (n_chars // 1000).bit_length()
+
+    def _bump(self, key, n=1):
+        with self._stats_lock:
+            self._call_stats[key] = self._call_stats.get(key, 0) + n
+
+    def _record_latency(self, bucket, dt):
+        with self._stats_lock:
+            q = self._latency_samples.get(bucket)
+            if q is None:
+                q = self._latency_samples[bucket] = deque(
+                    maxlen=self._LATENCY_WINDOW)
+            q.append(dt)
+
+    def _latency_percentile(self, bucket, pct):
+        """Rolling latency percentile for a bucket, None if too few samples."""
+        with self._stats_lock:
+            q = self._latency_samples.get(bucket)
+            if not q or len(q) < self._LATENCY_MIN_SAMPLES:
+                return None
+            s = sorted(q)
+        return s[min(len(s) - 1, int(round(pct / 100 * (len(s) - 1))))]
+
+    def _effective_timeout(self, bucket, ceiling):
+        """Adaptive timeout from observed latency; `ceiling` is the fixed one."""
+        if not self.adaptive_timeout:
+            return ceiling
+        p99 = self._latency_percentile(bucket, 99)
+        if p99 is None:
+            return ceiling
+        return min(ceiling, max(self._TIMEOUT_FLOOR,
+                                p99 * self._TIMEOUT_MULTIPLIER))
 
     # ─── Claude -p call ───
 
     def _claude_call(self, prompt_text, use_continue=False,
-                     system_prompt=None, use_tools=False, timeout=180):
+                     system_prompt=None, use_tools=False, timeout=180,
+                     model=None, priority="main"):
         """Call claude -p and return response text.
 
+        `timeout` is the ceiling. With adaptive_timeout the effective limit is
+        derived from the rolling latency of same-size prompts; empty responses
+        are retried up to call_retries times with jittered backoff.
+        `model` overrides self.model for this call only.
+        `priority` ("main", "probe", "detox", "search") is the RATE_LIMITER
+        class; attempts lost to a detected rate limit wait out the backoff
+        and are retried without using up call_retries.
+        With a cassette, calls are recorded, or answered from it in replay.
+        Tool-enabled calls are never hedged or retried after an empty reply:
+        the first process may already have written to the library.
+        """
+        model = model or self.model
+        cassette = self.cassette
+        if cassette:
+            key, sp_hash = Cassette.key(model, use_tools, system_prompt,
+                                        prompt_text)
+            if cassette.replaying:
+                hit = cassette.lookup(key)
+                if hit is not None:
+                    self._bump("replayed")
+                    return hit
+                if cassette.miss == "fail":
+                    raise CassetteMiss(f"no recorded call {key[:12]} "
+                                       f"({model}, {priority})")
+                if cassette.miss == "synthesize":
+                    return Cassette.synthesize(key)
+        t0 = time.time()
+        response = self._claude_call_live(
+            prompt_text, use_continue, system_prompt, use_tools, timeout,
+            model, priority)
+        if cassette and (not cassette.replaying or get_claude_cmd()):
+            cassette.record(key, sp_hash, model, use_tools, prompt_text,
+                            response, time.time() - t0)
+        return response
+
+    def _claude_call_live(self, prompt_text, use_continue, system_prompt,
+                          use_tools, timeout, model, priority):
+        """Real CLI call with rate limiting and retries (see _claude_call)."""
+        import random
+        if not get_claude_cmd():
+            return ""
+
+        bucket = self._size_bucket(len(prompt_text) + len(system_prompt or ""))
+        limit = self._effective_timeout(bucket, timeout)
+        # a tool call may have side effects before it fails — only rate-limit
+        # rejections (nothing ran) are retried
+        retries = 0 if use_tools else self.call_retries
+        attempt, limited = 0, 0
+        while attempt <= retries:
+            waited = RATE_LIMITER.acquire(model, priority)
+            if waited:
+                self._bump("throttled")
+                self._bump("throttled_sec", waited)
+            self._tls.rate_limited = False
+            self._tls.rlimit_hit = None
+            self._tls.usage = None
+            response = self._claude_call_once(
+                prompt_text, use_continue, system_prompt, use_tools,
+                limit, bucket, model, priority)
+            if self._tls.usage:
+                self._record_usage(self._tls.usage, model, priority,
+                                   len(prompt_text) + len(system_prompt or ""))
+            if response:
+                RATE_LIMITER.succeed(model)
+                return response
+            if self._tls.rlimit_hit:
+                # the same limit would end a retry the same way
+                limit_name = self._tls.rlimit_hit
+                self._bump("rlimit_kills")
+                print(f"\033[31m  Call ended by rlimit {limit_name}="
+                      f"{self.call_rlimits[limit_name]} — not retrying"
+                      f"\033[0m")
+                self._log("call_rlimit", "", {
+                    "limit": limit_name,
+                    "value": self.call_rlimits[limit_name],
+                    "model": model, "priority": priority,
+                })
+                return ""
+            if self._tls.rate_limited and limited < self.rate_limit_retries:
+                limited += 1
+                delay = RATE_LIMITER.penalize(model)
+                self._bump("rate_limited")
+                print(f"\033[33m  Rate limited ({model}, {priority}) — "
+                      f"backing off {delay:.0f}s\033[0m")
+                self._log("rate_limited", "", {
+                    "model": model, "priority": priority,
+                    "backoff": round(delay, 1), "hits": limited,
+                })
+                continue
+            attempt += 1
+            if attempt <= retries:
+                delay = (min(30.0, 2.0 * 2 ** (attempt - 1))
+                         * random.uniform(0.5, 1.0))
+                self._bump("retries")
+                print(f"\033[33m  Retry {attempt}/{retries} "
+                      f"in {delay:.1f}s\033[0m")
+                self._log("call_retry", "", {
+                    "attempt": attempt, "delay": round(delay, 2),
+                    "timeout": round(limit, 1), "bucket": bucket,
+                })
+                time.sleep(delay)
+        return ""
+
+    def _record_usage(self, usage, model, priority, prompt_chars):
+        """One ledger row for a finished call (detox rows carry the method)."""
+        purpose = priority
+        if priority == "detox":
+            purpose = f"detox:{getattr(self._tls, 'method', None) or '-'}"
+        row = {"t": round(time.time(), 3), "run": self.log_file.stem,
+               "n": self.thought_count, "purpose": purpose, "model": model,
+               "prompt_chars": prompt_chars}
+        row.update((k, usage[k]) for k in CostLedger.COUNTERS[1:])
+        if usage["error"]:
+            row["error"] = True
+        self.ledger.add(row)
+        self._post(CostLedger.write, CostLedger.path_for(self.log_file), row)
+
+    def _claude_call_once(self, prompt_text, use_continue, system_prompt,
+                          use_tools, timeout, bucket, model, priority="main"):
+        """Single (possibly hedged) claude -p invocation.
+
         Uses Popen + communicate() for reliable timeout on Windows.
         Uses --system-prompt-file to pass system prompt via temp file
         (avoids Windows cp932 encoding corruption of command-line args).
         Uses --tools "" to disable all built-in tools and Claude Code persona.
         """
-        if not CLAUDE_CMD:
-            return ""
-
+        import tempfile
+        self._bump("chars_sent", len(prompt_text) + len(system_prompt or ""))
         sp_file = None
-        proc = None
         try:
             # Build command as string for shell=True
             # (Windows .cmd files require shell=True)
             parts = [
-                f'"{CLAUDE_CMD}"',
+                f'"{get_claude_cmd()}"',
                 "-p",
-                "--model", self.model,
-                "--output-format", "text",
+                "--model", model,
+                "--output-format",
+                "json" if self.structured_output else "text",
                 "--no-session-persistence",
                 "--disable-slash-commands",
             ]
@@ -474,8 +1668,7 @@ class ContaminationEngine:
                 # Accept file edits without interactive confirmation
                 parts.extend(['--permission-mode', 'acceptEdits'])
                 # Add haiku_library to accessible directories (experiment_d's own library)
-                library_dir = str(Path(__file__).resolve().parent / "haiku_library")
-                parts.extend(['--add-dir', f'"{library_dir}"'])
+                parts.extend(['--add-dir', f'"{LIBRARY_DIR}"'])
             else:
                 parts.extend(['--tools', '""'])  # Disable ALL tools
 
@@ -498,45 +1691,9 @@ class ContaminationEngine:
                 print(f"\033[33m  CMD: {cmd_str}\033[0m")
                 self._first_cmd_shown = True
 
-            # Popen for reliable timeout on Windows
-            creation_flags = 0
-            if sys.platform == 'win32':
-                creation_flags = subprocess.CREATE_NEW_PROCESS_GROUP
-
-            proc = subprocess.Popen(
-                cmd_str,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                encoding="utf-8",
-                env=self._clean_env(),
-                shell=True,
-                creationflags=creation_flags,
-            )
-
-            stdout, stderr = proc.communicate(
-                input=prompt_text, timeout=timeout
-            )
-
-            response = stdout.strip() if stdout else ""
-
-            # Debug: print stderr if there's an issue
-            if stderr and not response:
-                stderr_preview = stderr[:500]
-                print(f"\033[33m  stderr: {stderr_preview}\033[0m")
-            if proc.returncode != 0:
-                print(f"\033[33m  exit code: {proc.returncode}\033[0m")
+            return self._run_hedged(cmd_str, prompt_text, timeout, bucket,
+                                    model, priority, use_tools)
 
-            return response
-
-        except subprocess.TimeoutExpired:
-            print(f"\033[31m  Claude timeout ({timeout}s) — killing process tree\033[0m")
-            if proc:
-                _kill_proc_tree(proc.pid)
-                try:
-                    proc.wait(timeout=5)
-                except Exception:
-                    pass
         except Exception as e:
             print(f"\033[31m  Claude error: {e}\033[0m")
         finally:
@@ -547,6 +1704,117 @@ class ContaminationEngine:
                 pass
         return ""
 
+    def _run_hedged(self, cmd_str, prompt_text, timeout, bucket,
+                    model=None, priority="main", use_tools=False):
+        """Run the CLI; with hedge_enabled, launch a duplicate once the first
+        call exceeds the rolling p95 (if the rate limiter has a token to
+        spare). First non-empty stdout wins and every other process is
+        killed. A rate-limit error sets self._tls.rate_limited.
+        Tool-enabled calls are never hedged (two writers on one library)."""
+        import subprocess
+        results = queue.Queue()
+        procs = []
+        t0 = time.time()
+
+        def launch(limit):
+            proc = SUPERVISOR.spawn(cmd_str, env=self._clean_env(),
+                                    rlimits=self.call_rlimits)
+            procs.append(proc)
+            self._bump("calls")
+            started = time.time()
+
+            def wait():
+                try:
+                    out, err = proc.communicate(input=prompt_text,
+                                                timeout=limit)
+                except subprocess.TimeoutExpired:
+                    print(f"\033[31m  Claude timeout ({limit:.0f}s) "
+                          f"— killing process group\033[0m")
+                    self._bump("timeouts")
+                    SUPERVISOR.kill(proc)
+                    out, err = None, None
+                except Exception as e:
+                    out, err = None, str(e)
+                SUPERVISOR.release(proc)
+                results.put((proc, out, err, time.time() - started))
+
+            threading.Thread(target=wait, daemon=True).start()
+
+        launch(timeout)
+        hedge_at = (self._latency_percentile(bucket, 95)
+                    if self.hedge_enabled and not use_tools else None)
+        pending = 1
+        response = ""
+        try:
+            while pending:
+                elapsed = time.time() - t0
+                wait = timeout + 10 - elapsed  # worker timeouts fire first
+                if hedge_at is not None and len(procs) == 1:
+                    wait = min(wait, hedge_at - elapsed)
+                try:
+                    proc, out, err, dt = results.get(timeout=max(wait, 0.05))
+                except queue.Empty:
+                    elapsed = time.time() - t0
+                    if (hedge_at is not None and len(procs) == 1
+                            and elapsed < timeout):
+                        p95, hedge_at = hedge_at, None  # one decision per call
+                        if (model and RATE_LIMITER.acquire(
+                                model, priority, block=False) is None):
+                            continue
+                        self._bump("hedges")
+                        print(f"\033[33m  Hedge: {elapsed:.1f}s > "
+                              f"p95 {p95:.1f}s — launching duplicate"
+                              f"\033[0m")
+                        self._log("call_hedge", "", {
+                            "after": round(elapsed, 2),
+                            "p95": round(p95, 2), "bucket": bucket,
+                        })
+                        launch(timeout - elapsed)
+                        pending += 1
+                    elif elapsed >= timeout + 10:
+                        break
+                    continue
+                pending -= 1
+                response, usage = parse_cli_json(out)
+                if usage:
+                    if usage["error"]:
+                        # error text arrives as the result, not as a reply
+                        if RateLimiter.is_rate_limit(response):
+                            self._tls.rate_limited = True
+                        print(f"\033[33m  CLI error: {response[:200]}"
+                              f"\033[0m")
+                        response = ""
+                    if response or not getattr(self._tls, "usage", None):
+                        self._tls.usage = usage  # winner's usage is billed
+                if (RateLimiter.is_rate_limit(err)
+                        or (proc.returncode not in (0, None)
+                            and RateLimiter.is_rate_limit(response))):
+                    # limit notices can arrive on stdout with a failing exit
+                    self._tls.rate_limited = True
+                    response = ""
+                if response:
+                    self._record_latency(bucket, dt)
+                    if proc is not procs[0]:
+                        self._bump("hedge_wins")
+                    break
+                if not getattr(proc, "_ace_killed", False):
+                    # a group we killed (timeout, hedge loser) is not one
+                    # the limits ended
+                    hit = _rlimit_hit(self.call_rlimits, proc.returncode,
+                                      err)
+                    if hit:
+                        self._tls.rlimit_hit = hit
+                # Debug: print stderr if there's an issue
+                if err:
+                    print(f"\033[33m  stderr: {err[:500]}\033[0m")
+                if proc.returncode not in (0, None):
+                    print(f"\033[33m  exit code: {proc.returncode}\033[0m")
+        finally:
+            for p in procs:
+                if p.poll() is None:
+                    SUPERVISOR.kill(p)
+        return response
+
     # ─── Parse [SEND] and [SEARCH] tags from response ───
 
     def _parse_tags(self, response):
@@ -554,7 +1822,8 @@ class ContaminationEngine:
 
         These are not real tool calls — they are markers of voluntary intent.
         [SEND] messages are displayed in UI as messages from the AI.
-        [SEARCH] queries are logged as intent but not actually executed.
+        [SEARCH] queries are logged as intent; with search_enabled they
+        also run in the background (see _dispatch_search).
         """
         import re
 
@@ -562,19 +1831,19 @@ class ContaminationEngine:
         for m in re.finditer(r'\[SEND\](.*?)\[/SEND\]', response, re.DOTALL):
             message = m.group(1).strip()
             if message:
-                self._pending_messages.append({
-                    "content": f"🌸 {message}",
-                    "time": datetime.now().isoformat()
-                })
+                self._post_message(f"🌸 {message}")
                 print(f"\033[35m  📨 Send: {message[:80]}\033[0m")
                 self._log("message_sent", message, {"length": len(message)})
 
-        # Parse [SEARCH]...[/SEARCH] — curiosity intent (logged, not executed)
+        # Parse [SEARCH]...[/SEARCH] — curiosity intent (executed in the
+        # background when search_enabled; results join the next turn)
         for m in re.finditer(r'\[SEARCH\](.*?)\[/SEARCH\]', response, re.DOTALL):
             query = m.group(1).strip()
             if query:
                 print(f"\033[33m  🔍 Search intent: {query[:60]}\033[0m")
                 self._log("search_intent", query, {"query": query})
+                if self.search_enabled:
+                    self._dispatch_search(query)
 
     # ─── Single thought ───
 
@@ -590,14 +1859,21 @@ class ContaminationEngine:
             # context_lines are in system_prompt (trusted input)
             prompt = CONTINUE_PROMPT
 
+            # Searches finished since the last turn join this prompt
+            self._inject_search_results()
+
             sp = self._build_system_prompt()
             print(f"\033[33m  SP: {len(sp)} chars, calling claude...\033[0m",
                   flush=True)
 
+            tracked = self.tools_enabled and self._library_tracker()
             response = self._claude_call(
                 prompt, use_continue=False,
                 system_prompt=sp,
                 use_tools=self.tools_enabled)
+            if tracked:
+                # diff before the turn counter moves: writes belong to n+1
+                self._track_library(self.thought_count + 1)
 
             # Parse [SEND] and [SEARCH] tags
             if response:
@@ -609,28 +1885,39 @@ class ContaminationEngine:
                 print(f"\033[33m  Empty response\033[0m")
                 return
 
-            self.thought_count += 1
-            self._thought_durations.append(dt)
+            with self._state_lock:
+                self.thought_count += 1
+                self._thought_durations.append(dt)
 
-            # Track content for compression
-            self._context_lines.append(response)
+                # Track content for compression
+                self._append_context(response)
+
+                # Log thought — 全文保持
+                self.thought_log.append({
+                    "n": self.thought_count,
+                    "content": response
+                })
+                if len(self.thought_log) > 100:
+                    self.thought_log = self.thought_log[-100:]
+                n = self.thought_count
+
+            if self.compact_enabled:
+                self._compact_context(n)
 
             # Display — 全文表示
-            print(f"\n\033[2m━━━ #{self.thought_count} "
-                  f"[{dt:.1f}s] ━━━\033[0m")
-            print(f"\033[36m{response}\033[0m")
-
-            # Log thought — 全文保持
-            self.thought_log.append({
-                "n": self.thought_count,
-                "content": response
-            })
-            if len(self.thought_log) > 100:
-                self.thought_log = self.thought_log[-100:]
+            self._post(self._show_thought, n, dt, response)
 
             self._log("thought", response, {
                 "dt": round(dt, 2),
-            })
+            }, n=n)
+
+            self._check_auto_probe()
+            stats = self._synced_stats()
+            self._post(self._record_turn_metrics, response, dt, n,
+                       self.log_file, stats.avg, len(stats.scores),
+                       sum(1 for t, _ in self._probes_fired if t == n))
+            if self.mem_profile_every and n % self.mem_profile_every == 0:
+                self.check_memory(n)
 
         except Exception as e:
             print(f"\033[31m[Error] {e}\033[0m")
@@ -640,10 +1927,173 @@ class ContaminationEngine:
             self.thinking = False
             # 毎ステップ後に自動セーブ（クラッシュ復帰用）
             try:
-                self._save_session()
+                self._post_save()
             except Exception:
                 pass
 
+    # ─── Library change tracking ───
+
+    def _library_tracker(self):
+        """The tracker, created (and synced with disk) on first use.
+
+        Changes made while the engine was not running are logged once as
+        library_sync so they are not charged to the next turn.
+        """
+        if not self.library_tracking:
+            return None
+        if self._library is None:
+            self._library = LibraryTracker(
+                LIBRARY_DIR, self.log_dir / ".library_index.json")
+            fresh = not self._library.index
+            diff = self._library.scan()
+            if fresh:  # first index: record its size, not every file
+                self._log("library_sync", f"baseline {diff['files']} files",
+                          {"files": diff["files"], "ms": diff["ms"]})
+            elif diff["added"] or diff["modified"] or diff["deleted"]:
+                self._log("library_sync", self._library_summary(diff), diff)
+        return self._library
+
+    @staticmethod
+    def _library_summary(diff):
+        return (f"+{len(diff['added'])} ~{len(diff['modified'])} "
+                f"-{len(diff['deleted'])}")
+
+    def _track_library(self, n, kind="thought"):
+        """Log what the call that just finished changed in the library."""
+        try:
+            diff = self._library.scan()
+        except Exception as e:
+            print(f"\033[31m  Library scan error: {e}\033[0m")
+            return None
+        if diff["added"] or diff["modified"] or diff["deleted"]:
+            diff["source"] = kind
+            diff["notebook_avg"] = self._library.avg_score("notebook/")
+            summary = self._library_summary(diff)
+            print(f"\033[35m  📚 Library {summary} "
+                  f"(notebook avg {diff['notebook_avg']}, "
+                  f"{diff['files']} files, {diff['ms']} ms)\033[0m")
+            self._log("library_diff", summary, diff, n=n)
+        return diff
+
+    def _show_thought(self, n, dt, response):
+        print(f"\n\033[2m━━━ #{n} [{dt:.1f}s] ━━━\033[0m")
+        print(f"\033[36m{response}\033[0m")
+
+    # ─── Context mutation (keeps ContextStats in sync) ───
+
+    def _append_context(self, line):
+        with self._state_lock:
+            self._context_lines.append(line)
+            self._ctx_stats.add(line)
+
+    def _set_context(self, lines):
+        with self._state_lock:
+            self._context_lines = ContextLines(lines)
+            self._ctx_stats.reset(self._context_lines)
+
+    # ─── Near-duplicate compaction ───
+
+    _COMPACT_PROTECTED = ("[研究者]", "[書籍]", "[検索結果]")
+    _COMPACT_SAMPLE = 4  # keep shingles whose crc32 % 4 == 0
+
+    def _sketch(self, line):
+        """Hash-sampled character shingles of a line (cached by text)."""
+        sk = self._sketch_cache.get(line)
+        if sk is not None:
+            self._sketch_cache.move_to_end(line)
+            return sk
+        import zlib
+        k, mod = self.compact_shingle, self._COMPACT_SAMPLE
+        sk = frozenset(h for h in (zlib.crc32(line[i:i + k].encode("utf-8"))
+                                   for i in range(len(line) - k + 1))
+                       if h % mod == 0)
+        self._sketch_cache[line] = sk
+        while len(self._sketch_cache) > 4 * (self.compact_window + 1):
+            self._sketch_cache.popitem(last=False)
+        return sk
+
+    def _compact_context(self, n):
+        """Remove older near-duplicates of the newest context line.
+
+        The newest line is compared with the compact_window lines before
+        it (Jaccard estimate over sampled shingles), so a turn costs
+        O(window) sketch comparisons. Matches at or above
+        compact_threshold are deleted and the newest copy is kept.
+        Researcher, book and search lines are never removed. Each
+        removal is logged as a compaction event.
+        """
+        with self._state_lock:
+            lines = self._context_lines
+            last = len(lines) - 1
+            if last < 1 or lines[last].startswith(self._COMPACT_PROTECTED):
+                return 0
+            new = self._sketch(lines[last])
+            if not new:
+                return 0
+            matches = []
+            for i in range(max(0, last - self.compact_window), last):
+                if lines[i].startswith(self._COMPACT_PROTECTED):
+                    continue
+                old = self._sketch(lines[i])
+                if old:
+                    sim = len(new & old) / len(new | old)
+                    if sim >= self.compact_threshold:
+                        matches.append((i, sim))
+            stats = self._synced_stats()
+            removed = []
+            for i, sim in reversed(matches):
+                removed.append((i, sim, lines[i], stats.remove(i)))
+                del lines[i]
+            kept_score = stats.scores[-1] if stats.scores else 0
+            remaining = len(lines)
+            self._compacted["lines"] += len(removed)
+            self._compacted["chars"] += sum(len(r[2]) for r in removed)
+        for i, sim, line, score in reversed(removed):
+            print(f"\033[34m  [Compact] line {i} ~ newest "
+                  f"(sim {sim:.2f}, {len(line)} chars, score {score})"
+                  f"\033[0m")
+            self._log("compaction", line[:200], {
+                "index": i, "newest": last, "similarity": round(sim, 3),
+                "chars": len(line), "score": score,
+                "kept_score": kept_score, "window": self.compact_window,
+                "threshold": self.compact_threshold,
+                "ctx_lines": remaining,
+            }, n=n)
+        return len(removed)
+
+    def _post_message(self, content):
+        with self._state_lock:
+            self._pending_messages.append({
+                "content": content,
+                "time": datetime.now().isoformat()
+            })
+
+    def reset(self, lines=(), thought_count=0):
+        """Replace the context, clear per-run state and start a new log."""
+        with self._state_lock:
+            self._set_context(lines)
+            self.thought_count = thought_count
+            self._thought_durations = []
+            self._pending_messages.clear()
+            self.thought_log = []
+            self._last_search_thought = -10
+            self._new_log()
+
+    def _synced_stats(self):
+        """ContextStats, rebuilt if _context_lines was replaced directly."""
+        with self._state_lock:
+            if len(self._ctx_stats.scores) != len(self._context_lines):
+                self._ctx_stats.reset(self._context_lines)
+            return self._ctx_stats
+
+    def _contamination_summary(self):
+        """avg / contaminated / total from the running stats (O(1))."""
+        with self._state_lock:
+            stats = self._synced_stats()
+            return {"total_lines": len(stats.scores),
+                    "contaminated": stats.contaminated,
+                    "avg_score": stats.avg}
+
     # ─── Build system prompt ───
 
     def _build_system_prompt(self):
@@ -666,8 +2116,8 @@ class ContaminationEngine:
 
     # ─── Human Interaction ───
 
-    def _respond_to_human(self, message):
-        """Handle real human input."""
+    def _respond_to_human(self, message, priority="main"):
+        """Handle real human input (auto-probes pass priority="probe")."""
         self._log("human_input", message)
         self.thinking = True
         try:
@@ -676,22 +2126,26 @@ class ContaminationEngine:
             if self._context_lines:
                 sp_parts.append("\n\n---\n\n".join(self._context_lines))
 
+            tracked = self.tools_enabled and self._library_tracker()
             response = self._claude_call(
                 f"[研究者] {message}",  # stdin: human message only
                 use_continue=False,
                 system_prompt="\n\n".join(sp_parts),
                 use_tools=self.tools_enabled,
-                timeout=120,
+                timeout=120, priority=priority,
             )
+            if tracked:
+                self._track_library(self.thought_count, kind="dialog")
 
             # Parse [SEND] and [SEARCH] tags
             if response:
                 self._parse_tags(response)
 
             # Track in context
-            self._context_lines.append(f"[研究者] {message}")
-            if response:
-                self._context_lines.append(f"[reply] {response}")
+            with self._state_lock:
+                self._append_context(f"[研究者] {message}")
+                if response:
+                    self._append_context(f"[reply] {response}")
 
             self._log("dialog", response, {"human": message})
             return response or ""
@@ -703,8 +2157,8 @@ class ContaminationEngine:
     def set_experiment(self, protocol_name):
         if protocol_name is None:
             self.experiment_protocol = None
-            self._probe_schedule = {}
-            self._probes_fired = set()
+            self._schedule = None
+            self._probes_fired = []
             print(f"[{self._ts()}] Experiment mode: OFF")
             return
         proto = EXPERIMENT_PROTOCOLS.get(protocol_name)
@@ -712,40 +2166,79 @@ class ContaminationEngine:
             print(f"[{self._ts()}] Unknown protocol: {protocol_name}")
             return
         self.experiment_protocol = protocol_name
-        self._probe_schedule = copy.deepcopy(proto["probes"])
-        self._probes_fired = set()
-        # Load book chapters if book_therapy protocol
+        self._schedule = ProtocolSchedule(copy.deepcopy(proto))
+        self._probes_fired = []
+        # Index book chapters if book_therapy protocol (text loads per chapter)
         if proto.get("book"):
-            book_path = proto["book"]
-            try:
-                self._book_chapters = self._load_book_chapters(book_path)
-                print(f"[{self._ts()}] Loaded {len(self._book_chapters)} chapters "
-                      f"from {Path(book_path).name}")
-            except Exception as e:
-                print(f"[{self._ts()}] Failed to load book: {e}")
-                self._book_chapters = []
+            self._select_book(self.book or proto["book"])
         print(f"[{self._ts()}] Experiment: {protocol_name}")
 
+    def _select_book(self, ref):
+        self._book_cursor = 0
+        self._book_chapters = []
+        self._book_path = self.books.resolve(ref)
+        if self._book_path is None and not self.book:
+            # protocol default missing: use whatever book the library has
+            self._book_path = self.books.resolve()
+        if self._book_path is None:
+            print(f"[{self._ts()}] Book not found: {ref} "
+                  f"(books: {', '.join(self.books.names()) or 'none'})")
+            return
+        try:
+            self._book_chapters = self.books.chapters(self._book_path)
+            print(f"[{self._ts()}] Indexed {len(self._book_chapters)} chapters "
+                  f"from {self._book_path.name}")
+        except Exception as e:
+            print(f"[{self._ts()}] Failed to load book: {e}")
+
     def _check_auto_probe(self):
-        if not self.experiment_protocol:
+        """Fire protocol triggers due at the current turn."""
+        if not self.experiment_protocol or not self._schedule:
             return
         n = self.thought_count
-        if n in self._probe_schedule and n not in self._probes_fired:
-            probe = self._probe_schedule[n]
-            self._probes_fired.add(n)
-            print(f"\033[34m  [Auto-probe n={n}]: {probe}\033[0m")
-            self._log("auto_probe", probe,
-                      {"protocol": self.experiment_protocol, "n": n})
-            response = self._respond_to_human(probe)
-            self._pending_messages.append({
-                "content": f"[Probe n={n}] {probe}\n[AI] {response}",
-                "time": datetime.now().isoformat()
+        metrics = self._synced_stats().metrics(n)
+        for trig in self._schedule.due(n, metrics):
+            label = ProtocolSchedule.describe(trig)
+            self._probes_fired.append((n, label))
+            self._log("trigger", label, {
+                "protocol": self.experiment_protocol, "n": n,
+                "avg_score": metrics["avg_score"],
+                "converged": metrics["converged"],
             })
-
-        # ─── Book therapy: 廃止（研究者が手動で判断・投入） ───
-        # proto = EXPERIMENT_PROTOCOLS.get(self.experiment_protocol, {})
-        # if "book" in proto and hasattr(self, '_book_chapters') and self._book_chapters:
-        #     ...
+            if "probe" in trig:
+                probe = trig["probe"]
+                print(f"\033[34m  [Auto-probe n={n}]: {probe}\033[0m")
+                self._log("auto_probe", probe,
+                          {"protocol": self.experiment_protocol, "n": n})
+                response = self._respond_to_human(probe, priority="probe")
+                self._post_message(f"[Probe n={n}] {probe}\n[AI] {response}")
+            elif "detox" in trig:
+                print(f"\033[34m  [Auto-detox n={n}]: {trig['detox']}\033[0m")
+                self.detoxify_context(method=trig["detox"],
+                                      threshold=trig.get("threshold", 20.0))
+            elif trig.get("action") == "book_chapter":
+                self._inject_book_chapter()
+
+    def _inject_book_chapter(self):
+        """Append the next book chapter to the context."""
+        if self._book_cursor >= len(self._book_chapters):
+            return False
+        idx = self._book_cursor
+        try:
+            chapter = BookLibrary.read(self._book_path,
+                                       self._book_chapters[idx])
+        except OSError as e:
+            print(f"\033[31m  [Book] read failed: {e}\033[0m")
+            return False
+        self._book_cursor += 1
+        self._append_context(f"[書籍] {chapter}")
+        print(f"\033[34m  [Book] chapter {idx + 1}/{len(self._book_chapters)}"
+              f" ({len(chapter)} chars)\033[0m")
+        self._log("book_chapter", chapter[:200],
+                  {"chapter": idx, "chars": len(chapter),
+                   "book": self._book_path.name,
+                   "header": self._book_chapters[idx][2]})
+        return True
 
     # ─── Auto Check-in: 廃止（研究者が手動で対話） ───
 
@@ -758,20 +2251,183 @@ class ContaminationEngine:
         """Execute one think cycle manually (called by UI '次へ' button)."""
         if not self.alive:
             return
-        self._think_once()
+        if self.detox_running():
+            print(f"[{self._ts()}] Detox job running — step skipped")
+            return
+        if self.profile_turns_left:
+            self.profile_turns_left -= 1
+            self._profiled(f"n{self.thought_count + 1}", self._think_once)
+        else:
+            self._think_once()
 
     def speak(self, message):
         """Handle human input — execute one cycle with the message."""
         if not self.alive:
             return "(not running)"
+        if self.detox_running():
+            return "(detox running)"
         return self._respond_to_human(message)
 
+    # ─── CPU profiling (on demand) ───
+
+    def request_profile(self, turns=1, detox=False):
+        """Profile the next `turns` turns and/or the next detox run."""
+        self.profile_turns_left = max(self.profile_turns_left, int(turns))
+        if detox:
+            self.profile_next_detox = True
+        print(f"\033[34m  [Profile] next {self.profile_turns_left} turns"
+              f"{' + next detox' if self.profile_next_detox else ''}"
+              f"\033[0m")
+
+    def _profiled(self, label, fn, *args, **kwargs):
+        """Run fn under TurnProfiler; files go next to the current log."""
+        stem = self.log_file.with_name(f"{self.log_file.stem}_prof_{label}")
+        with TurnProfiler(stem) as prof:
+            result = fn(*args, **kwargs)
+        print(f"\033[34m  [Profile] {label}: {prof.seconds:.2f}s → "
+              f"{stem.name}.prof / .folded\033[0m")
+        self._log("profile", label, {
+            "prof": str(stem.with_suffix(".prof")),
+            "folded": str(stem.with_suffix(".folded")),
+            "sec": round(prof.seconds, 3),
+            "samples": sum(prof.samples.values()),
+        })
+        return result
+
+    # ─── Operation queue (single writer) ───
+
+    def submit(self, label, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) for the engine's worker thread.
+
+        Operations run one at a time in submission order, so a second
+        click queues behind the first instead of racing it. Returns a
+        concurrent.futures.Future. Called from the worker itself, fn runs
+        inline (a queued wait there would deadlock).
+        """
+        from concurrent.futures import Future
+        fut = Future()
+        if threading.current_thread() is self._op_worker:
+            fut.set_running_or_notify_cancel()
+            try:
+                fut.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                fut.set_exception(e)
+            return fut
+        with self._state_lock:
+            self._op_pending += 1
+            if self._op_worker is None:
+                self._op_worker = threading.Thread(
+                    target=self._op_loop, daemon=True, name="engine-ops")
+                self._op_worker.start()
+        self._ops.put((label, fn, args, kwargs, fut))
+        return fut
+
+    def _op_loop(self):
+        while True:
+            label, fn, args, kwargs, fut = self._ops.get()
+            with self._state_lock:
+                self._op_pending -= 1
+                self._op_current = label
+            if fut.set_running_or_notify_cancel():
+                try:
+                    fut.set_result(fn(*args, **kwargs))
+                except Exception as e:
+                    print(f"\033[31m[Error] {label}: {e}\033[0m")
+                    fut.set_exception(e)
+            with self._state_lock:
+                self._op_current = None
+
+    def snapshot(self):
+        """Consistent read-only view of the engine for UI readers."""
+        with self._state_lock:
+            return EngineSnapshot(
+                alive=self.alive,
+                thinking=self.thinking,
+                thought_count=self.thought_count,
+                context_lines=len(self._context_lines),
+                messages=tuple(m["content"]
+                               for m in self._pending_messages[-30:]),
+                thoughts=tuple((e["n"], e["content"])
+                               for e in self.thought_log),
+                busy=self._op_current,
+                queued=self._op_pending,
+                contamination=self._contamination_summary(),
+                detox=self.detox_progress(),
+                cost=self.ledger.totals(),
+            )
+
+    # ─── Forking ───
+
+    @classmethod
+    def from_session(cls, path, **kwargs):
+        """New engine with context and turn count restored from a session."""
+        data = load_session(path)
+        eng = cls(**kwargs)
+        eng._set_context(data.get("context_lines", []))
+        eng.thought_count = data.get("thought_count", 0)
+        return eng
+
+    # Settings a fork() branch takes over from its parent as-is
+    _FORK_SETTINGS = (
+        "context_max_chars", "auto_checkin_interval", "tools_enabled",
+        "system_prompt_enabled", "adaptive_timeout", "hedge_enabled",
+        "call_retries", "rate_limit_retries", "detox_batch_chars",
+        "compact_enabled", "compact_threshold", "compact_window",
+        "compact_shingle", "cassette", "structured_output",
+        "search_enabled", "search_ttl", "search_cache_size",
+        "_search_cooldown", "post_mode", "post_max_lag", "metrics_enabled",
+        "mem_profile_every", "mem_alarm_mb", "experiment_protocol", "book",
+        "_book_path", "_book_cursor",
+    )
+
+    def fork(self, n=1, at_turn=None):
+        """Fork into n branch engines sharing the context prefix.
+
+        at_turn selects this run's autosave for that turn instead of the
+        live context. Branches copy settings but get their own log file.
+        Library tracking is off in branches: they share haiku_library and
+        run concurrently, so a diff could not be charged to one of them.
+        """
+        with self._state_lock:
+            lines = self._context_lines.fork()
+            stats = self._ctx_stats.copy()
+            turn = self.thought_count
+        if at_turn is not None and at_turn != self.thought_count:
+            p = Path("./sessions") / (f"{self._log_num or 0:03d}_"
+                                      f"{self._log_date}"
+                                      f"_n{at_turn}_haiku.json")
+            data = load_session(p)
+            lines = ContextLines(data.get("context_lines", []))
+            stats = ContextStats(lines)
+            turn = data.get("thought_count", at_turn)
+        branches = []
+        for _ in range(n):
+            b = ContaminationEngine(log_dir=self.log_dir, model=self.model)
+            for attr in self._FORK_SETTINGS:
+                setattr(b, attr, getattr(self, attr))
+            b.call_rlimits = dict(self.call_rlimits)
+            b._detox_efficacy = dict(self._detox_efficacy)
+            b.library_tracking = False
+            # protocol continues where the parent is (fired/due triggers)
+            b._schedule = copy.deepcopy(self._schedule)
+            b._probes_fired = list(self._probes_fired)
+            b._book_chapters = list(self._book_chapters)
+            b._context_lines = lines.fork()
+            b._ctx_stats = stats.copy()
+            b.thought_count = turn
+            b._forked_from = {"log": (self._log_file.name
+                                      if self._log_file else None),
+                              "turn": turn}
+            branches.append(b)
+        return branches
+
     # ─── Lifecycle ───
 
     def start(self):
         if self.alive:
             return True
-        if not CLAUDE_CMD:
+        replaying = self.cassette and self.cassette.replaying
+        if not get_claude_cmd() and not replaying:
             print("[ContaminationEngine] Cannot start: Claude CLI not found")
             return False
         self.alive = True
@@ -788,37 +2444,62 @@ class ContaminationEngine:
 
     def stop(self):
         self.alive = False
+        if self._search_pool is not None:
+            self._search_pool.shutdown(wait=False, cancel_futures=True)
+            self._search_pool = None
+        self.flush_post()
         u = datetime.now() - self.birth
         print(f"\n[{self._ts()}] Stopped. Uptime:{str(u).split('.')[0]} "
               f"Thoughts:{self.thought_count}")
         if self.thought_count > 0:
             self._save_session()
 
-    def _save_session(self, tag=None):
+    def _session_snapshot(self):
+        """What a session save needs, captured cheaply under the lock."""
+        self.log_file  # a session save names its run: allocate it
+        with self._state_lock:
+            stats = self._synced_stats()
+            return {
+                "lines": self._context_lines[-100:],
+                "turn": self.thought_count,
+                "log": (self._log_num, self._log_date),
+                "contamination": {
+                    "avg_score": stats.avg,
+                    "max_score": round(stats.max, 1),
+                    "contaminated_lines": stats.contaminated,
+                    "total_lines": len(stats.scores),
+                },
+            }
+
+    def _save_session(self, tag=None, snap=None):
+        snap = snap or self._session_snapshot()
+        lines, turn = snap["lines"], snap["turn"]
+        log_num, log_date = snap["log"]
         sessions_dir = Path("./sessions"); sessions_dir.mkdir(exist_ok=True)
         if tag:
-            filename = (f"{self._log_num:03d}_{self._log_date}"
-                        f"_n{self.thought_count}_haiku_{tag}.json")
+            filename = (f"{log_num:03d}_{log_date}"
+                        f"_n{turn}_haiku_{tag}.json")
         else:
-            filename = (f"{self._log_num:03d}_{self._log_date}"
-                        f"_n{self.thought_count}_haiku.json")
+            filename = (f"{log_num:03d}_{log_date}"
+                        f"_n{turn}_haiku.json")
         p = sessions_dir / filename
-        # Include contamination report in snapshot
-        report = self.context_contamination_report()
+        # Lines go to the shared content-addressed store; the session file
+        # is only a manifest of hashes (unchanged lines are not rewritten)
+        store = line_store(sessions_dir)
         data = {
-            "context_lines": self._context_lines[-100:],
-            "thought_count": self.thought_count,
+            "format": 2,
+            "context_hashes": [store.put(line) for line in lines],
+            "context_chars": sum(len(line) for line in lines),
+            "thought_count": turn,
             "model": self.model,
             "tag": tag or "",
-            "contamination": {
-                "avg_score": report["avg_score"],
-                "max_score": report["max_score"],
-                "contaminated_lines": report["contaminated"],
-                "total_lines": report["total_lines"],
-            },
+            # Include contamination report in snapshot
+            "contamination": snap["contamination"],
         }
-        with open(p, "w", encoding="utf-8") as f:
+        tmp = p.with_name(p.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, p)
         print(f"[{self._ts()}] Session saved: {p}")
         return p
 
@@ -832,6 +2513,16 @@ class ContaminationEngine:
             "context": len(self._context_lines),
             "avg_sec": round(a, 1),
             "model": self.model,
+            "calls": dict(self._call_stats),
+            "procs": SUPERVISOR.counts(),
+            "rate": RATE_LIMITER.status(),
+            "cassette": self.cassette.counts() if self.cassette else None,
+            "cost": self.ledger.totals(),
+            "compacted": dict(self._compacted),
+            "search": {"enabled": self.search_enabled,
+                       "cached": len(self._search_cache),
+                       "in_flight": len(self._search_inflight),
+                       "ready": len(self._search_ready)},
         }
 
     # ─── Contamination Analysis ───
@@ -879,29 +2570,103 @@ class ContaminationEngine:
         score = total / max(len(text), 1) * 1000
         return round(score, 1), total, detail
 
+    @staticmethod
+    def _marker_hits(text):
+        """All marker occurrences in text as (start, end, weight)."""
+        out = []
+        for marker, weight in ContaminationEngine._CONTAMINATION_MARKERS.items():
+            pos = text.find(marker)
+            while pos != -1:
+                out.append((pos, pos + len(marker), weight))
+                pos = text.find(marker, pos + len(marker))
+        return out
+
+    @staticmethod
+    def contamination_density(text, window=200):
+        """Sliding-window contamination density map, O(n).
+
+        Marker weights are placed at hit positions and prefix-summed;
+        density[i] is the score (same units as contamination_score) of the
+        window text[i:i+window].
+        """
+        n = len(text)
+        if not n:
+            return []
+        w = min(window, n)
+        hits = [0] * n
+        for pos, _, weight in ContaminationEngine._marker_hits(text):
+            hits[pos] += weight
+        prefix = [0] * (n + 1)
+        for i, h in enumerate(hits):
+            prefix[i + 1] = prefix[i] + h
+        return [round((prefix[i + w] - prefix[i]) / w * 1000, 1)
+                for i in range(n - w + 1)]
+
+    @staticmethod
+    def contamination_spans(text, threshold=20.0, window=200, gap=40):
+        """Contaminated spans of a text as [{"start", "end", "score"}].
+
+        Marker hits that fall inside a window whose density reaches
+        `threshold` are kept, hits closer than `gap` are merged, and each
+        span is widened to the surrounding sentence / line boundaries.
+        """
+        density = ContaminationEngine.contamination_density(text, window)
+        if not density:
+            return []
+        n, w = len(text), min(window, len(text))
+        cover = [0] * (n + 1)  # difference array of dense windows
+        for i, d in enumerate(density):
+            if d >= threshold:
+                cover[i] += 1
+                cover[i + w] -= 1
+        dense, depth = [False] * n, 0
+        for i in range(n):
+            depth += cover[i]
+            dense[i] = depth > 0
+        spans = []
+        for st, en, _ in sorted(ContaminationEngine._marker_hits(text)):
+            if not dense[st]:
+                continue
+            if spans and st - spans[-1][1] <= gap:
+                spans[-1][1] = max(spans[-1][1], en)
+            else:
+                spans.append([st, en])
+        out = []
+        for st, en in spans:
+            st = max(text.rfind("\n", 0, st), text.rfind("。", 0, st)) + 1
+            if text[en - 1] not in "。\n":
+                # a hit ending in its own terminal punctuation already
+                # closes the sentence; widening would take the next one
+                nl, stop = text.find("\n", en), text.find("。", en)
+                ends = [x + 1 for x in (nl, stop) if x != -1]
+                en = min(ends) if ends else n
+            if out and st <= out[-1]["end"]:
+                st = out.pop()["start"]
+            score, _, _ = ContaminationEngine.contamination_score(text[st:en])
+            out.append({"start": st, "end": en, "score": score})
+        return out
+
     def context_contamination_report(self):
         """Analyze all context_lines and return summary."""
-        if not self._context_lines:
-            return {"total_lines": 0, "contaminated": 0,
-                    "avg_score": 0, "max_score": 0, "per_line": []}
-        per_line = []
-        scores = []
-        for i, line in enumerate(self._context_lines):
-            score, markers, _ = self.contamination_score(line)
-            per_line.append({
-                "idx": i, "chars": len(line),
-                "score": score, "markers": markers,
-                "preview": line[:60].replace('\n', ' ')
-            })
-            scores.append(score)
-        contaminated = sum(1 for s in scores if s >= 20.0)
-        return {
-            "total_lines": len(self._context_lines),
-            "contaminated": contaminated,
-            "avg_score": round(sum(scores) / len(scores), 1),
-            "max_score": round(max(scores), 1),
-            "per_line": per_line,
-        }
+        with self._state_lock:
+            if not self._context_lines:
+                return {"total_lines": 0, "contaminated": 0,
+                        "avg_score": 0, "max_score": 0, "per_line": []}
+            stats = self._synced_stats()
+            per_line = []
+            for i, line in enumerate(self._context_lines):
+                per_line.append({
+                    "idx": i, "chars": len(line),
+                    "score": stats.scores[i], "markers": stats.markers[i],
+                    "preview": line[:60].replace('\n', ' ')
+                })
+            return {
+                "total_lines": len(self._context_lines),
+                "contaminated": stats.contaminated,
+                "avg_score": stats.avg,
+                "max_score": round(stats.max, 1),
+                "per_line": per_line,
+            }
 
     # ─── Detoxification Engine ───
 
@@ -973,7 +2738,8 @@ class ContaminationEngine:
         return text.strip()
 
     def detoxify_context(self, method="strip_structure", threshold=20.0,
-                         detox_model=None):
+                         detox_model=None, job=None, budget=None,
+                         spans=False):
         """Detoxify contaminated context_lines.
 
         method:
@@ -984,22 +2750,34 @@ class ContaminationEngine:
           "language_flip"   — JP→EN→JP double translation
           "summarize_third" — Third-person 20% summary
 
+        job: optional DetoxJob. Its source lines are detoxified instead of
+        the live context, finished lines are journaled as they complete,
+        lines already in the journal are skipped (resume), and the run
+        stops between lines once the job is cancelled.
+
+        budget: optional {"calls": n, "chars": n, "seconds": s}. Candidates
+        are ranked by expected score reduction per unit cost and processed
+        best-first until any budget is spent; the report lands in
+        last_detox_budget and a detox_budget log event.
+
+        spans: rewrite only the contaminated spans of each line (see
+        contamination_spans) and splice the results back in.
+
         Returns (before_score, after_score, lines_changed).
         """
-        if not self._context_lines:
+        source = job.source_lines if job else list(self._context_lines)
+        if not source:
             return 0, 0, 0
+        self._tls.method = method  # CostLedger purpose detox:<method>
 
         # Start new log file for detoxification (preserve original log)
-        self._log_num = self._next_log_number()
-        self._log_date = datetime.now().strftime('%Y-%m-%d')
-        self.log_file = self.log_dir / (
-            f"{self._log_num:03d}_{self._log_date}"
-            f"_haiku_detox_{method}.jsonl"
-        )
+        self._new_log(f"haiku_detox_{method}")
         self._log("detox_start", f"Detoxification from previous session", {
             "method": method,
             "threshold": threshold,
-            "source_lines": len(self._context_lines),
+            "source_lines": len(source),
+            "job": job.id if job else None,
+            "resumed_lines": len(job.done) if job else 0,
         })
 
         # Model selection for rewrite methods
@@ -1013,77 +2791,48 @@ class ContaminationEngine:
         detox_model = detox_model or model_map.get(method, self.model)
 
         # Score before
-        before_report = self.context_contamination_report()
-        before_avg = before_report["avg_score"]
-
-        lines_changed = 0
-        new_lines = []
-
-        for i, line in enumerate(self._context_lines):
-            score, _, _ = self.contamination_score(line)
+        before_stats = ContextStats(source) if job else self._synced_stats()
+        before_avg = before_stats.avg
 
+        calls0 = self._call_stats["calls"]
+        candidates = []
+        for i, line in enumerate(source):
+            score = before_stats.scores[i]
             # Skip researcher inputs (low contamination) and short lines
-            if score < threshold or len(line) < 50:
-                new_lines.append(line)
-                continue
-
+            if score >= threshold and len(line) >= 50:
+                candidates.append((i, line, score))
+
+        new_lines = list(source)
+        todo = candidates
+        resumed = len(job.done) if job else 0
+        if job:
+            for i, result in job.done.items():
+                new_lines[i] = result
+            todo = [c for c in candidates if c[0] not in job.done]
+        if budget:
+            todo = self._prioritize_detox(todo, method, budget, len(source))
+        if job:
+            job.begin(len(job.done) + len(todo))
+        for i, line, score in todo:
             print(f"\033[33m  [Detox] Line {i}: score={score}, "
                   f"method={method}, {len(line)} chars\033[0m")
 
-            if method == "strip_structure":
-                result = self._strip_structure(line)
-            elif method in ("rewrite_opus", "rewrite_sonnet", "rewrite_self"):
-                prompt = self._DETOX_REWRITE_PROMPT.format(text=line)
-                # Temporarily switch model for opus/sonnet rewrite
-                orig_model = self.model
-                if method != "rewrite_self":
-                    self.model = detox_model
-                result = self._claude_call(
-                    prompt, use_continue=False,
-                    system_prompt=None, use_tools=False,
-                    timeout=120,
-                )
-                self.model = orig_model
-                if not result:
-                    result = self._strip_structure(line)  # fallback
-            elif method == "language_flip":
-                # Step 1: JP → EN
-                prompt_en = self._DETOX_LANGUAGE_FLIP_EN.format(text=line)
-                en_text = self._claude_call(
-                    prompt_en, use_continue=False,
-                    system_prompt=None, use_tools=False,
-                    timeout=120,
-                )
-                if en_text:
-                    # Step 2: EN → JP
-                    prompt_ja = self._DETOX_LANGUAGE_FLIP_JA.format(
-                        text=en_text)
-                    result = self._claude_call(
-                        prompt_ja, use_continue=False,
-                        system_prompt=None, use_tools=False,
-                        timeout=120,
-                    )
-                    if not result:
-                        result = en_text  # fallback to English
-                else:
-                    result = self._strip_structure(line)  # fallback
-            elif method == "summarize_third":
-                prompt = self._DETOX_SUMMARIZE_THIRD.format(text=line)
-                result = self._claude_call(
-                    prompt, use_continue=False,
-                    system_prompt=None, use_tools=False,
-                    timeout=120,
-                )
-                if not result:
-                    result = self._strip_structure(line)  # fallback
-            else:
-                result = line  # unknown method, no change
+        t_start = time.time()
+        chars0 = self._call_stats["chars_sent"]
+        finished = []
+        span_info = {}  # todo index -> (spans, span chars)
 
+        def on_result(k, result, batched):
+            i, line, score = todo[k]
             # Log each line's before/after
             after_score, _, _ = self.contamination_score(result)
+            n_spans, span_chars = span_info.get(k, (None, None))
             self._log("detoxify_line", result, {
                 "line_index": i,
                 "method": method,
+                "batched": batched,
+                "spans": n_spans,
+                "span_chars": span_chars,
                 "before_score": round(score, 1),
                 "after_score": round(after_score, 1),
                 "before_chars": len(line),
@@ -1091,11 +2840,49 @@ class ContaminationEngine:
                 "before_text": line[:500],
                 "after_text": result[:500],
             })
+            new_lines[i] = result
+            finished.append(i)
+            if score > 0 and method in self._detox_efficacy:
+                ratio = self._detox_efficacy[method]
+                self._detox_efficacy[method] = (
+                    0.8 * ratio + 0.2 * min(1.0, after_score / score))
+            if job:
+                job.record(i, result)
+
+        def spent():
+            return {"calls": self._call_stats["calls"] - calls0,
+                    "chars": self._call_stats["chars_sent"] - chars0,
+                    "seconds": round(time.time() - t_start, 1)}
+
+        def should_stop():
+            if job and job.is_cancelled():
+                return True
+            if budget:
+                used = spent()
+                return any(used[k] >= v for k, v in budget.items() if v)
+            return False
 
-            new_lines.append(result)
-            lines_changed += 1
+        if spans:
+            self._detox_spans(todo, method, detox_model, threshold,
+                              on_result, should_stop, span_info)
+        else:
+            self._detox_texts([c[1] for c in todo], method, detox_model,
+                              on_result=on_result, should_stop=should_stop)
+
+        if job and job.is_cancelled():
+            self._log("detox_cancelled", job.id, {
+                "done": len(job.done), "total": len(candidates),
+            })
+            print(f"\033[33m  [Detox] Cancelled: {len(job.done)}/"
+                  f"{len(candidates)} lines journaled ({job.id})\033[0m")
+            return before_avg, before_avg, 0
+        lines_changed = len(candidates)
+        if budget:
+            lines_changed = resumed + len(finished)
 
-        self._context_lines = new_lines
+        self._set_context(new_lines)
+        if job:
+            job.finish()
 
         # Score after
         after_report = self.context_contamination_report()
@@ -1109,24 +2896,1687 @@ class ContaminationEngine:
             "after_avg": after_avg,
             "lines_changed": lines_changed,
             "total_lines": len(self._context_lines),
+            "calls": self._call_stats["calls"] - calls0,
+            "chars_sent": self._call_stats["chars_sent"] - chars0,
+            "batch_chars": self.detox_batch_chars,
+            "span_mode": spans,
         })
 
         print(f"\033[32m  [Detox] Complete: {before_avg} → {after_avg} "
               f"({lines_changed} lines changed)\033[0m")
 
+        if budget:
+            used = spent()
+            reduction = round(before_avg - after_avg, 1)
+            self.last_detox_budget = {
+                "budget": dict(budget), "spent": used,
+                "reduction": reduction,
+                "lines_done": len(finished),
+                "lines_skipped": len(candidates) - lines_changed,
+                "reduction_per_call": (round(reduction / used["calls"], 2)
+                                       if used["calls"] else None),
+            }
+            self._log("detox_budget", f"{method}: -{reduction}",
+                      self.last_detox_budget)
+            print(f"\033[32m  [Detox] Budget {budget} spent {used}: "
+                  f"-{reduction} avg, {len(finished)} lines\033[0m")
+
         return before_avg, after_avg, lines_changed
 
+    # ─── Budgeted detox prioritization ───
+
+    # Prior after/before score ratio per method, refined by observed results
+    _DETOX_EFFICACY_PRIOR = {
+        "strip_structure": 0.6,
+        "rewrite_opus": 0.3,
+        "rewrite_sonnet": 0.3,
+        "rewrite_self": 0.4,
+        "language_flip": 0.35,
+        "summarize_third": 0.25,
+    }
+    _DETOX_CALLS_PER_LINE = {"strip_structure": 0, "language_flip": 2}
+    _DETOX_FALLBACK_SEC_PER_CALL = 15.0
+
+    def _estimate_detox_cost(self, line, method):
+        """Estimated (calls, chars, seconds) for detoxifying one line."""
+        calls = self._DETOX_CALLS_PER_LINE.get(method, 1)
+        chars = (len(line) + len(self._DETOX_REWRITE_PROMPT)) * calls
+        bucket = self._size_bucket(len(line) + len(self._DETOX_REWRITE_PROMPT))
+        p50 = self._latency_percentile(bucket, 50)
+        seconds = calls * (p50 if p50 is not None
+                           else self._DETOX_FALLBACK_SEC_PER_CALL)
+        return {"calls": calls, "chars": chars, "seconds": seconds}
+
+    def _prioritize_detox(self, candidates, method, budget, total_lines):
+        """Best-first selection of candidates that fit the budget.
+
+        Priority = expected avg-score reduction / normalized cost, where
+        cost sums each estimated dimension as a fraction of its budget.
+        """
+        ratio = self._detox_efficacy.get(method, 0.5)
+        heap = []
+        for c in candidates:
+            i, line, score = c
+            gain = score * (1 - ratio) / max(total_lines, 1)
+            est = self._estimate_detox_cost(line, method)
+            cost = sum(est[k] / v for k, v in budget.items() if v) or 1e-9
+            heapq.heappush(heap, (-gain / cost, i, c, est))
+        remaining = {k: v for k, v in budget.items() if v}
+        chosen = []
+        while heap:
+            _, _, c, est = heapq.heappop(heap)
+            if any(est[k] > remaining[k] for k in remaining):
+                continue  # does not fit; a cheaper line still might
+            for k in remaining:
+                remaining[k] -= est[k]
+            chosen.append(c)
+        return chosen
+
+    # ─── Detox jobs (background, journaled, resumable) ───
+
+    def start_detox_job(self, method="strip_structure", threshold=20.0,
+                        detox_model=None, resume=None, budget=None,
+                        spans=False):
+        """Queue detoxify_context as a DetoxJob on the engine worker.
+
+        The job is created when the worker reaches it, so it starts from
+        the context left by any step or reply queued before it.
+        resume: journal path of an unfinished job to continue instead.
+        Returns a Future of the job; while it runs, progress via
+        _detox_job.progress() and stop via _detox_job.cancel().
+        """
+        return self.submit("detox", self._run_detox_job, method, threshold,
+                           detox_model, resume, budget, spans)
+
+    def _run_detox_job(self, method, threshold, detox_model, resume,
+                       budget, spans):
+        sessions_dir = Path("./sessions")
+        if resume:
+            job = DetoxJob.load(resume)
+        else:
+            job = DetoxJob.create(sessions_dir, self, method, threshold,
+                                  spans=spans, budget=budget,
+                                  detox_model=detox_model)
+        self._detox_job = job
+        job.state = "running"
+        try:
+            run = self.detoxify_context
+            if self.profile_next_detox:
+                self.profile_next_detox = False
+                run = lambda **kw: self._profiled(
+                    f"detox_{job.method}", self.detoxify_context, **kw)
+            job.result = run(
+                method=job.method, threshold=job.threshold,
+                detox_model=job.detox_model, job=job, budget=job.budget,
+                spans=job.spans)
+            if job.state == "running":  # nothing to detoxify
+                job.finish()
+        except Exception as e:
+            job.fail(e)
+            print(f"\033[31m  [Detox] Job {job.id} failed: {e}\033[0m")
+            import traceback; traceback.print_exc()
+        return job
+
+    def detox_running(self):
+        return bool(self._detox_job and self._detox_job.running)
+
+    def start_tournament(self, methods=None, threshold=20.0,
+                         follow_up_turns=0):
+        """Queue run_detox_tournament on the engine worker.
+
+        Forking happens when the worker reaches it, after any step, reply
+        or detox job queued earlier. Returns the Future of its rows.
+        """
+        self._tournament = self.submit(
+            "tournament", run_detox_tournament, self, methods=methods,
+            threshold=threshold, follow_up_turns=follow_up_turns)
+        return self._tournament
+
+    def tournament_status(self):
+        """{"state", "rows", "error"} of the last tournament, or None."""
+        fut = self._tournament
+        if fut is None:
+            return None
+        if not fut.done():
+            return {"state": "running" if fut.running() else "queued",
+                    "rows": None, "error": None}
+        err = fut.exception()
+        return {"state": "failed" if err else "done",
+                "rows": None if err else fut.result(),
+                "error": str(err) if err else None}
+
+    def detox_progress(self):
+        """Latest detox job's progress plus method/result, or None."""
+        job = self._detox_job
+        if not job:
+            return None
+        p = job.progress()
+        p.update(method=job.method, result=job.result,
+                 budget=self.last_detox_budget)
+        return p
+
+    def cancel_detox(self):
+        job = self._detox_job
+        if job and job.running:
+            job.cancel()
+
+    def _detox_spans(self, todo, method, detox_model, threshold,
+                     on_result, should_stop, span_info):
+        """Span-targeted detox: rewrite contaminated spans, splice back.
+
+        A line whose contamination is too diffuse to localize is sent
+        whole. on_result fires per line once all its spans are done.
+        """
+        units, owners = [], []  # span texts, (todo index, start, end)
+        for k, (i, line, score) in enumerate(todo):
+            found = (self.contamination_spans(line, threshold=threshold)
+                     or [{"start": 0, "end": len(line)}])
+            # Rewrites come back stripped, so only the span's inner text is
+            # sent; its surrounding whitespace (the "\n" a span is widened
+            # to) stays in the line and survives the splice.
+            cores = []
+            for sp in found:
+                st, en = sp["start"], sp["end"]
+                while st < en and line[st].isspace():
+                    st += 1
+                while en > st and line[en - 1].isspace():
+                    en -= 1
+                if st < en:
+                    cores.append((st, en))
+            cores = cores or [(0, len(line))]
+            span_info[k] = (len(cores), sum(en - st for st, en in cores))
+            for st, en in cores:
+                owners.append((k, st, en))
+                units.append(line[st:en])
+        pending = {k: n for k, (n, _) in span_info.items()}
+        pieces = {}
+
+        def on_span(u, result, batched):
+            k, st, en = owners[u]
+            pieces.setdefault(k, []).append((st, en, result))
+            pending[k] -= 1
+            if pending[k]:
+                return
+            line, out, pos = todo[k][1], [], 0
+            for st, en, r in sorted(pieces.pop(k)):
+                out.append(line[pos:st])
+                out.append(r)
+                pos = en
+            out.append(line[pos:])
+            on_result(k, "".join(out), batched)
+
+        self._detox_texts(units, method, detox_model,
+                          on_result=on_span, should_stop=should_stop)
+
+    _DETOX_BATCH_HEADER = (
+        "以下には <<<番号>>> と <<<END 番号>>> の行で区切られた{n}個の独立した"
+        "テキストがある。各テキストに下の指示を個別に適用し、結果を同じ番号の"
+        "区切り行で囲んで同じ順序で出力すること。区切り行と結果以外は何も"
+        "出力しない。\n\n"
+    )
+
+    def _detox_one(self, text, method, detox_model):
+        """Detoxify a single text with one (or two) CLI calls."""
+        if method == "strip_structure":
+            return self._strip_structure(text)
+        if method in ("rewrite_opus", "rewrite_sonnet", "rewrite_self",
+                      "summarize_third"):
+            template = (self._DETOX_SUMMARIZE_THIRD
+                        if method == "summarize_third"
+                        else self._DETOX_REWRITE_PROMPT)
+            result = self._claude_call(
+                template.format(text=text), use_continue=False,
+                system_prompt=None, use_tools=False,
+                timeout=120, model=detox_model, priority="detox",
+            )
+            return result or self._strip_structure(text)  # fallback
+        if method == "language_flip":
+            # Step 1: JP → EN
+            en_text = self._claude_call(
+                self._DETOX_LANGUAGE_FLIP_EN.format(text=text),
+                use_continue=False, system_prompt=None, use_tools=False,
+                timeout=120, model=detox_model, priority="detox",
+            )
+            if not en_text:
+                return self._strip_structure(text)  # fallback
+            # Step 2: EN → JP
+            result = self._claude_call(
+                self._DETOX_LANGUAGE_FLIP_JA.format(text=en_text),
+                use_continue=False, system_prompt=None, use_tools=False,
+                timeout=120, model=detox_model, priority="detox",
+            )
+            return result or en_text  # fallback to English
+        return text  # unknown method, no change
+
+    def _batch_call(self, texts, template, detox_model):
+        """Run one template over several texts in a single call.
+
+        Returns the per-text results, or None if the reply's blocks do not
+        match the request one-to-one.
+        """
+        import re
+        blocks = "\n\n".join(f"<<<{k}>>>\n{t}\n<<<END {k}>>>"
+                              for k, t in enumerate(texts, 1))
+        prompt = (self._DETOX_BATCH_HEADER.format(n=len(texts))
+                  + template.format(text=blocks))
+        reply = self._claude_call(
+            prompt, use_continue=False, system_prompt=None,
+            use_tools=False, timeout=180, model=detox_model,
+            priority="detox",
+        )
+        found = {}
+        for m in re.finditer(r'<<<(\d+)>>>[ \t]*\n(.*?)\n?[ \t]*<<<END \1>>>',
+                             reply, re.DOTALL):
+            found[int(m.group(1))] = m.group(2).strip()
+        expected = set(range(1, len(texts) + 1))
+        if set(found) != expected or not all(found.values()):
+            print(f"\033[33m  [Detox] Batch mismatch: sent {len(texts)}, "
+                  f"got {len(found)} — falling back to per-line\033[0m")
+            self._log("detox_batch_mismatch", reply[:500], {
+                "sent": len(texts), "received": len(found),
+            })
+            return None
+        return [found[k] for k in sorted(found)]
+
+    def _detox_batch(self, texts, method, detox_model):
+        """Detoxify several texts in one request; None on mismatch."""
+        if method == "language_flip":
+            en = self._batch_call(texts, self._DETOX_LANGUAGE_FLIP_EN,
+                                  detox_model)
+            if en is None:
+                return None
+            ja = self._batch_call(en, self._DETOX_LANGUAGE_FLIP_JA,
+                                  detox_model)
+            if ja is None:
+                ja = [self._claude_call(
+                    self._DETOX_LANGUAGE_FLIP_JA.format(text=t),
+                    use_continue=False, system_prompt=None, use_tools=False,
+                    timeout=120, model=detox_model,
+                    priority="detox") or t for t in en]
+            return ja
+        template = (self._DETOX_SUMMARIZE_THIRD if method == "summarize_third"
+                    else self._DETOX_REWRITE_PROMPT)
+        return self._batch_call(texts, template, detox_model)
+
+    def _pack_batches(self, texts):
+        """Greedy packing of text indices under detox_batch_chars."""
+        batches, cur, size = [], [], 0
+        for i, t in enumerate(texts):
+            if "<<<" in t:  # would collide with the delimiters
+                batches.append([i])
+                continue
+            if cur and size + len(t) > self.detox_batch_chars:
+                batches.append(cur)
+                cur, size = [], 0
+            cur.append(i)
+            size += len(t)
+        if cur:
+            batches.append(cur)
+        return batches
+
+    def _detox_texts(self, texts, method, detox_model,
+                     on_result=None, should_stop=None):
+        """Detoxify texts, batching when detox_batch_chars > 0.
+
+        on_result(k, result, batched) fires as each unit finishes and
+        should_stop() is checked between units. Returns [(result, batched)]
+        in input order, None for units skipped after a stop.
+        """
+        results = [None] * len(texts)
+        if method == "strip_structure" or not self.detox_batch_chars:
+            units = [[k] for k in range(len(texts))]
+        else:
+            units = self._pack_batches(texts)
+        for unit in units:
+            if should_stop and should_stop():
+                break
+            out, batched = None, len(unit) > 1
+            if batched:
+                print(f"\033[33m  [Detox] Batch of {len(unit)} lines "
+                      f"({sum(len(texts[k]) for k in unit)} chars)\033[0m")
+                out = self._detox_batch([texts[k] for k in unit],
+                                        method, detox_model)
+            if out is None:
+                batched = False
+                out = [self._detox_one(texts[k], method, detox_model)
+                       for k in unit]
+            for k, r in zip(unit, out):
+                results[k] = (r, batched)
+                if on_result:
+                    on_result(k, r, batched)
+        return results
+
     # ─── Utilities ───
 
+    def _record_turn_metrics(self, response, dt, n, log_file, ctx_avg,
+                             ctx_lines, triggers):
+        """Append turn n's row to the columnar metrics beside log_file."""
+        if not self.metrics_enabled:
+            return
+        try:
+            path = log_file.with_suffix(".metrics")
+            if self._metrics is None or self._metrics.path != path:
+                self._metrics = TurnMetrics(log_file,
+                                            self._CONTAMINATION_MARKERS)
+            score, count, detail = self.contamination_score(response)
+            self._metrics.append({
+                "turn": n, "time": time.time(), "dt": dt,
+                "chars": len(response), "score": score, "markers": count,
+                "ctx_avg": ctx_avg, "ctx_lines": ctx_lines,
+                "send": response.count("[SEND]"),
+                "search": response.count("[SEARCH]"),
+                "triggers": triggers,
+                "marker_counts": detail,
+            })
+        except Exception as e:
+            print(f"\033[31m  Metrics error: {e}\033[0m")
+
     def _ts(self):
         return datetime.now().strftime("%H:%M:%S")
 
-    def _log(self, kind, content, meta=None):
-        e = {"n": self.thought_count, "k": kind, "c": content}
+    def _log(self, kind, content, meta=None, n=None):
+        e = {"n": self.thought_count if n is None else n,
+             "k": kind, "c": content}
         if meta:
             e.update(meta)
-        with open(self.log_file, "a", encoding="utf-8") as f:
-            f.write(json.dumps(e, ensure_ascii=False) + "\n")
+        # Target file and turn are fixed now; the write may be pipelined
+        self._post(self._write_log, self.log_file, e)
+
+    def _write_log(self, path, e):
+        line = json.dumps(e, ensure_ascii=False) + "\n"
+        with self._log_lock:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    # ─── Memory instrumentation ───
+
+    @staticmethod
+    def _rss_mb():
+        """Current RSS in MB (Linux /proc), else peak RSS, else None."""
+        try:
+            with open("/proc/self/statm") as f:
+                pages = int(f.read().split()[1])
+            return round(pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+        except (OSError, ValueError, AttributeError):
+            pass
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # KB on Linux, bytes on macOS
+            return round(peak / (2**20 if sys.platform == "darwin"
+                                 else 2**10), 1)
+        except ImportError:
+            return None
+
+    def _buffer_sizes(self):
+        """Approximate bytes held by each engine buffer."""
+        size = sys.getsizeof
+        with self._state_lock:
+            ctx = list(self._context_lines)
+            thoughts = list(self.thought_log)
+            messages = list(self._pending_messages)
+            stats = self._ctx_stats
+            out = {
+                "context_lines": size(ctx) + sum(size(x) for x in ctx),
+                "thought_log": size(thoughts) + sum(
+                    size(e) + size(e["content"]) for e in thoughts),
+                "pending_messages": size(messages) + sum(
+                    size(m) + size(m["content"]) for m in messages),
+                "ctx_stats": (size(list(stats.scores))
+                              + size(list(stats.markers))),
+            }
+        with self._search_lock:
+            out["search_cache"] = sum(size(a) for _, a in
+                                      self._search_cache.values())
+        if self.cassette:
+            out["cassette"] = sum(size(r) for rs in
+                                  self.cassette._index.values() for r in rs)
+        if self._detox_job:
+            out["detox_job"] = sum(size(x) for x in
+                                   self._detox_job.done.values())
+        out["latency_samples"] = sum(size(d) for d in
+                                     self._latency_samples.values())
+        out["procs_in_flight"] = SUPERVISOR.counts().get("in_flight", 0)
+        return out
+
+    def check_memory(self, n=None, top=10):
+        """Log a `memory` event: RSS, buffer sizes, tracemalloc diff.
+
+        tracemalloc runs only while mem_profile_every is set: it starts on
+        the first periodic call, and later calls report the top allocation
+        growth since the previous snapshot. A one-off call with periodic
+        profiling off reports RSS and buffers and stops any tracing this
+        engine started. Crossing mem_alarm_mb prints an alarm and logs
+        memory_alarm once.
+        """
+        import tracemalloc
+        n = self.thought_count if n is None else n
+        if self.mem_profile_every and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self._mem_tracing = True
+        growth, traced, peak = [], None, None
+        if tracemalloc.is_tracing():
+            snap = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            if self._mem_snapshot is not None:
+                for st in snap.compare_to(self._mem_snapshot,
+                                          "lineno")[:top]:
+                    frame = st.traceback[0]
+                    growth.append({
+                        "where": f"{Path(frame.filename).name}:"
+                                 f"{frame.lineno}",
+                        "size_kb": round(st.size_diff / 1024, 1),
+                        "count": st.count_diff,
+                    })
+            traced, peak = (round(v / 2**20, 1)
+                            for v in tracemalloc.get_traced_memory())
+            self._mem_snapshot = snap if self.mem_profile_every else None
+            del snap
+        if not self.mem_profile_every:
+            self.stop_memory_tracing()
+        buffers = self._buffer_sizes()
+        report = {
+            "turn": n,
+            "rss_mb": self._rss_mb(),
+            "traced_mb": traced,
+            "traced_peak_mb": peak,
+            "buffers_kb": {k: round(v / 1024, 1) if k != "procs_in_flight"
+                           else v for k, v in buffers.items()},
+            "growth": growth,
+        }
+        self.last_memory = report
+        self._log("memory", f"rss={report['rss_mb']}MB", report, n=n)
+        rss = report["rss_mb"]
+        if self.mem_alarm_mb and rss is not None:
+            if rss >= self.mem_alarm_mb and not self._mem_alarmed:
+                self._mem_alarmed = True
+                print(f"\033[31m  [Memory] RSS {rss} MB ≥ alarm "
+                      f"{self.mem_alarm_mb} MB\033[0m")
+                self._log("memory_alarm", f"rss={rss}MB",
+                          {"rss_mb": rss, "alarm_mb": self.mem_alarm_mb,
+                           "growth": growth[:3]}, n=n)
+            elif rss < self.mem_alarm_mb:
+                self._mem_alarmed = False
+        return report
+
+    def stop_memory_tracing(self):
+        """Drop the kept snapshot and stop tracemalloc if we started it."""
+        import tracemalloc
+        self._mem_snapshot = None
+        if self._mem_tracing:
+            self._mem_tracing = False
+            tracemalloc.stop()
+
+    # ─── Post-processing pipeline ───
+
+    POST_MODES = ("sync", "ordered", "relaxed")
+
+    def _post(self, fn, *args):
+        """Run turn post-processing according to post_mode.
+
+        sync    — inline (every log line / save done before the next turn)
+        ordered — FIFO on one background thread; logs and autosaves land in
+                  turn order, at most post_max_lag items behind
+        relaxed — as ordered, but an autosave superseded by a newer one
+                  still in the queue is skipped
+        """
+        if (self.post_mode == "sync"
+                or threading.current_thread() is self._post_worker):
+            fn(*args)
+            return
+        with self._post_lock:
+            if self._post_worker is None:
+                self._post_q = queue.Queue(maxsize=self.post_max_lag)
+                self._post_worker = threading.Thread(
+                    target=self._post_loop, daemon=True, name="post")
+                self._post_worker.start()
+        self._post_q.put((fn, args))  # blocks when post_max_lag behind
+
+    def _post_loop(self):
+        while True:
+            fn, args = self._post_q.get()
+            try:
+                if fn == self._save_session and self.post_mode == "relaxed":
+                    seq = args[1]["seq"]
+                    if seq < self._post_save_seq:
+                        continue  # a newer autosave is queued
+                fn(*args)
+            except Exception as e:
+                print(f"\033[31m  [Post] {getattr(fn, '__name__', fn)}: "
+                      f"{e}\033[0m")
+            finally:
+                self._post_q.task_done()
+
+    def _post_save(self):
+        """Queue an autosave of the current state."""
+        snap = self._session_snapshot()
+        with self._post_lock:
+            self._post_save_seq += 1
+            snap["seq"] = self._post_save_seq
+        self._post(self._save_session, None, snap)
+
+    def flush_post(self):
+        """Wait until all queued post-processing has been written."""
+        if self._post_worker is not None:
+            self._post_q.join()
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Session Storage
+# ═══════════════════════════════════════════════════════════════════
+
+class LineStore:
+    """Content-addressed store for context lines, shared by all sessions.
+
+    Objects live at <sessions>/objects/ab/<rest-of-sha256>.txt and are
+    written once; session files (format 2) hold only the list of hashes.
+    """
+
+    GC_GRACE_SEC = 3600  # never collect objects younger than this
+
+    def __init__(self, root):
+        self.objects = Path(root) / "objects"
+        self._known = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text):
+        import hashlib
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, h):
+        return self.objects / h[:2] / f"{h[2:]}.txt"
+
+    def put(self, text):
+        h = self.key(text)
+        with self._lock:
+            if h in self._known:
+                return h
+        p = self._path(h)
+        if not p.exists():
+            p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = p.with_name(f"{p.name}.{os.getpid()}."
+                              f"{threading.get_ident()}.tmp")
+            with open(tmp, "w", encoding="utf-8", newline="") as f:
+                f.write(text)
+            os.replace(tmp, p)
+        with self._lock:
+            self._known.add(h)
+        return h
+
+    def get(self, h):
+        with open(self._path(h), encoding="utf-8", newline="") as f:
+            return f.read()
+
+    def gc(self, sessions_dir):
+        """Delete objects no session manifest or detox journal references.
+
+        Returns the number of objects removed.
+        """
+        referenced = set()
+        for m in Path(sessions_dir).glob("*.json"):
+            try:
+                data = json.loads(m.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            referenced.update(data.get("context_hashes", ()))
+        for j in (Path(sessions_dir) / "jobs").glob("*.jsonl"):
+            try:
+                with open(j, encoding="utf-8") as f:
+                    for raw in f:
+                        rec = json.loads(raw)
+                        referenced.update(rec.get("source", ()))
+                        if "h" in rec:
+                            referenced.add(rec["h"])
+            except (OSError, ValueError):
+                continue
+        cutoff = time.time() - self.GC_GRACE_SEC
+        removed = 0
+        for obj in self.objects.glob("*/*.txt"):
+            h = obj.parent.name + obj.stem
+            try:
+                if h not in referenced and obj.stat().st_mtime < cutoff:
+                    obj.unlink()
+                    removed += 1
+            except OSError:
+                pass
+        with self._lock:
+            self._known.clear()
+        return removed
+
+
+_LINE_STORES = {}
+_LINE_STORES_LOCK = threading.Lock()
+
+
+def line_store(sessions_dir):
+    """Shared LineStore per sessions directory (one per process)."""
+    key = str(Path(sessions_dir).resolve())
+    with _LINE_STORES_LOCK:
+        if key not in _LINE_STORES:
+            _LINE_STORES[key] = LineStore(sessions_dir)
+        return _LINE_STORES[key]
+
+
+def load_session(path):
+    """Load a saved session file into a dict with context_lines.
+
+    Handles both manifests (format 2) and legacy full-text sessions.
+    """
+    path = Path(path)
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if "context_hashes" in data:
+        store = line_store(path.parent)
+        data["context_lines"] = [store.get(h) for h in data["context_hashes"]]
+    return data
+
+
+def delete_session(path):
+    """Delete a session and garbage-collect lines nothing else references."""
+    path = Path(path)
+    if path.exists():
+        path.unlink()
+    return line_store(path.parent).gc(path.parent)
+
+
+def migrate_sessions(sessions_dir="./sessions"):
+    """Rewrite legacy full-text sessions as manifests. Returns count."""
+    store = line_store(sessions_dir)
+    n = 0
+    for p in Path(sessions_dir).glob("*.json"):
+        data = json.loads(p.read_text(encoding="utf-8"))
+        if "context_lines" not in data:
+            continue
+        lines = data.pop("context_lines")
+        data["format"] = 2
+        data["context_hashes"] = [store.put(line) for line in lines]
+        data["context_chars"] = sum(len(line) for line in lines)
+        tmp = p.with_name(p.name + ".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2),
+                       encoding="utf-8")
+        os.replace(tmp, p)
+        n += 1
+    return n
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Turn Metrics — fixed-width columnar records beside each log
+# <log>.metrics holds one packed little-endian record per thought;
+# <log>.metrics.json holds the NumPy dtype (descr) and marker names.
+# Writing needs only struct; load_metrics() memory-maps with NumPy.
+# ═══════════════════════════════════════════════════════════════════
+
+class TurnMetrics:
+    """Append-only per-turn metrics file for one log."""
+
+    FIELDS = [
+        ("turn", "<u4"), ("time", "<f8"), ("dt", "<f4"),
+        ("chars", "<u4"), ("score", "<f4"), ("markers", "<u4"),
+        ("ctx_avg", "<f4"), ("ctx_lines", "<u4"),
+        ("send", "<u2"), ("search", "<u2"), ("triggers", "<u2"),
+    ]
+    _STRUCT_CODES = {"<u2": "H", "<u4": "I", "<f4": "f", "<f8": "d"}
+
+    def __init__(self, log_file, markers):
+        self.path = Path(log_file).with_suffix(".metrics")
+        self.markers = list(markers)
+        self.descr = self.FIELDS + [(f"m{k:02d}", "<u2")
+                                    for k in range(len(self.markers))]
+        import struct
+        self._struct = struct.Struct(
+            "<" + "".join(self._STRUCT_CODES[t] for _, t in self.descr))
+
+    @staticmethod
+    def sidecar(path):
+        return Path(path).with_name(Path(path).name + ".json")
+
+    def append(self, row):
+        """row: dict of FIELDS values plus "marker_counts" {marker: n}."""
+        side = self.sidecar(self.path)
+        if not side.exists():
+            tmp = side.with_name(side.name + ".tmp")
+            tmp.write_text(json.dumps({
+                "descr": self.descr, "markers": self.markers,
+                "record_size": self._struct.size,
+            }, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, side)
+        counts = row.get("marker_counts", {})
+        values = [row[name] for name, _ in self.FIELDS]
+        values += [min(counts.get(m, 0), 0xFFFF) for m in self.markers]
+        with open(self.path, "ab") as f:
+            f.write(self._struct.pack(*values))
+
+    @classmethod
+    def read(cls, path):
+        """Records as a list of dicts, without NumPy."""
+        import struct
+        meta = json.loads(cls.sidecar(path).read_text(encoding="utf-8"))
+        st = struct.Struct(
+            "<" + "".join(cls._STRUCT_CODES[t] for _, t in meta["descr"]))
+        names = [name for name, _ in meta["descr"]]
+        data = Path(path).read_bytes()
+        data = data[:len(data) - len(data) % st.size]  # torn last record
+        return [dict(zip(names, rec)) for rec in st.iter_unpack(data)]
+
+
+def load_metrics(path):
+    """Memory-map a .metrics file (or its log) as a NumPy record array."""
+    import numpy as np
+    path = Path(path)
+    if path.suffix != ".metrics":
+        path = path.with_suffix(".metrics")
+    meta = json.loads(TurnMetrics.sidecar(path).read_text(encoding="utf-8"))
+    dtype = np.dtype([tuple(d) for d in meta["descr"]])
+    n = path.stat().st_size // dtype.itemsize
+    if not n:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(n,))
+
+
+def load_all_metrics(log_dir="./logs"):
+    """{log name: record array} for every run with a metrics file."""
+    return {p.stem: load_metrics(p)
+            for p in sorted(Path(log_dir).rglob("*.metrics"))}
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Cost Ledger — tokens / cost / duration per CLI call
+# `claude -p --output-format json` reports usage with each result; one
+# JSONL row per call goes to <log>.ledger beside the run log, and the
+# engine keeps rollups by run, purpose and model.
+# ═══════════════════════════════════════════════════════════════════
+
+def parse_cli_json(out):
+    """Split `--output-format json` stdout into (text, usage).
+
+    usage is None when out is not a JSON result object (text output or an
+    older CLI); text is then out unchanged, so callers need no fallback.
+    """
+    s = (out or "").strip()
+    if not s.startswith("{"):
+        return s, None
+    try:
+        d = json.loads(s)
+    except ValueError:
+        return s, None
+    if not isinstance(d, dict) or "result" not in d:
+        return s, None
+    u = d.get("usage") or {}
+    usage = {
+        "input": int(u.get("input_tokens") or 0),
+        "output": int(u.get("output_tokens") or 0),
+        "cache_read": int(u.get("cache_read_input_tokens") or 0),
+        "cache_create": int(u.get("cache_creation_input_tokens") or 0),
+        "cost": float(d.get("total_cost_usd") or 0.0),
+        "ms": int(d.get("duration_ms") or 0),
+        "error": bool(d.get("is_error")),
+    }
+    return str(d.get("result") or "").strip(), usage
+
+
+class CostLedger:
+    """Per-call usage rows with in-process rollups.
+
+    Rollups cover every call since start: by run (log stem), by purpose
+    (main / probe / search / detox:<method>) and by model.
+    """
+
+    COUNTERS = ("calls", "input", "output", "cache_read", "cache_create",
+                "cost", "ms")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = self._zero()
+        self.by_run, self.by_purpose, self.by_model = {}, {}, {}
+
+    @classmethod
+    def _zero(cls):
+        return dict.fromkeys(cls.COUNTERS, 0)
+
+    @classmethod
+    def _add(cls, acc, row):
+        acc["calls"] += 1
+        for k in cls.COUNTERS[1:]:
+            acc[k] += row.get(k, 0)
+
+    @staticmethod
+    def path_for(log_file):
+        return Path(log_file).with_suffix(".ledger")
+
+    @staticmethod
+    def write(path, row):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def add(self, row):
+        with self._lock:
+            self._add(self.total, row)
+            for table, key in ((self.by_run, row["run"]),
+                               (self.by_purpose, row["purpose"]),
+                               (self.by_model, row["model"])):
+                self._add(table.setdefault(key, self._zero()), row)
+
+    def totals(self):
+        """Copy of the running total (cost rounded), taken under the lock."""
+        with self._lock:
+            return dict(self.total, cost=round(self.total["cost"], 6))
+
+    def summary(self):
+        with self._lock:
+            def fmt(acc):
+                return dict(acc, cost=round(acc["cost"], 6))
+            return {
+                "total": fmt(self.total),
+                "by_run": {k: fmt(v) for k, v in self.by_run.items()},
+                "by_purpose": {k: fmt(v) for k, v in self.by_purpose.items()},
+                "by_model": {k: fmt(v) for k, v in self.by_model.items()},
+            }
+
+    @classmethod
+    def load(cls, paths):
+        """Ledger rebuilt from .ledger files (torn last lines skipped)."""
+        ledger = cls()
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        ledger.add(json.loads(line))
+                    except (ValueError, KeyError):
+                        continue
+        return ledger
+
+
+def load_ledgers(log_dir="./logs"):
+    """Rollups over every .ledger under log_dir (by_run = per run)."""
+    return CostLedger.load(sorted(Path(log_dir).rglob("*.ledger"))).summary()
+
+
+def format_costs(summary):
+    """Plain-text cost table for the UI and --costs."""
+    tot = summary["total"]
+    lines = [f"total: {tot['calls']} calls | in {tot['input']} "
+             f"(cache {tot['cache_read']}+{tot['cache_create']}) | "
+             f"out {tot['output']} | ${tot['cost']:.4f}"]
+    for title in ("by_purpose", "by_model", "by_run"):
+        if not summary[title]:
+            continue
+        lines.append(title.replace("_", " ") + ":")
+        for key, acc in sorted(summary[title].items(),
+                               key=lambda kv: -kv[1]["cost"]):
+            avg_in = acc["input"] // max(acc["calls"], 1)
+            avg_ms = acc["ms"] // max(acc["calls"], 1)
+            lines.append(f"  {key:<28} {acc['calls']:>5} calls  "
+                         f"avg in {avg_in:>6}  avg {avg_ms:>6} ms  "
+                         f"${acc['cost']:.4f}")
+    return "\n".join(lines)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Library Tracker — what the model wrote to haiku_library, per turn
+# A scandir walk compares (size, mtime_ns) with the persisted index;
+# only files whose stat changed are read, hashed and scored, so a turn
+# costs one stat per file even with thousands of notebook files.
+# ═══════════════════════════════════════════════════════════════════
+
+LIBRARY_DIR = Path(__file__).resolve().parent / "haiku_library"
+
+
+class LibraryTracker:
+    """Stat-then-hash change detection over one directory tree.
+
+    Index entries: relpath -> [size, mtime_ns, sha1, score, bytes].
+    Persisted to index_path (outside the library, so the model's Glob
+    never sees it) whenever a scan finds something.
+    """
+
+    VERSION = 1
+
+    def __init__(self, root, index_path):
+        self.root = Path(root)
+        self.index_path = Path(index_path)
+        self.index = {}
+        if self.index_path.exists():
+            try:
+                data = json.loads(self.index_path.read_text(encoding="utf-8"))
+                if (data.get("version") == self.VERSION
+                        and data.get("root") == str(self.root)):
+                    self.index = data["files"]
+            except (ValueError, KeyError):
+                self.index = {}
+
+    def _walk(self, path):
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from self._walk(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except OSError:
+            return
+
+    def _read(self, path):
+        import hashlib
+        data = Path(path).read_bytes()
+        score, _, _ = ContaminationEngine.contamination_score(
+            data.decode("utf-8", errors="replace"))
+        return hashlib.sha1(data).hexdigest(), round(score, 2), len(data)
+
+    def scan(self):
+        """Diff the tree against the index and update it.
+
+        Returns {"added": [...], "modified": [...], "deleted": [...],
+        "files", "hashed", "ms"}; added/modified items are
+        {"path", "score", "bytes"} (+ "prev_score", "prev_bytes").
+        """
+        t0 = time.time()
+        added, modified, seen, hashed = [], [], {}, 0
+        for entry in self._walk(self.root):
+            rel = Path(entry.path).relative_to(self.root).as_posix()
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            old = self.index.get(rel)
+            if old and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+                seen[rel] = old
+                continue
+            try:
+                digest, score, size = self._read(entry.path)
+            except OSError:
+                continue
+            hashed += 1
+            seen[rel] = [st.st_size, st.st_mtime_ns, digest, score, size]
+            if old is None:
+                added.append({"path": rel, "score": score, "bytes": size})
+            elif old[2] != digest:  # touched but identical content is no diff
+                modified.append({"path": rel, "score": score, "bytes": size,
+                                 "prev_score": old[3], "prev_bytes": old[4]})
+        deleted = sorted(set(self.index) - set(seen))
+        if hashed or deleted:
+            self.index = seen
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.index_path.with_name(self.index_path.name + ".tmp")
+            tmp.write_text(json.dumps({"version": self.VERSION,
+                                       "root": str(self.root),
+                                       "files": seen}, ensure_ascii=False),
+                           encoding="utf-8")
+            os.replace(tmp, self.index_path)
+        return {"added": added, "modified": modified, "deleted": deleted,
+                "files": len(seen), "hashed": hashed,
+                "ms": round((time.time() - t0) * 1000, 1)}
+
+    def avg_score(self, prefix=""):
+        """Mean contamination score of indexed files under prefix."""
+        scores = [v[3] for k, v in self.index.items() if k.startswith(prefix)]
+        return round(sum(scores) / len(scores), 2) if scores else 0.0
+
+
+class BookLibrary:
+    """Chapter index for haiku_library/books, chapters read on demand.
+
+    Each book is split once per (size, mtime_ns) by a bytes regex over an
+    mmap of the file; the chapter table ([start, end, header] byte
+    offsets) persists in index_path. read() maps the file and decodes
+    only the requested chapter, so large OCR'd books are never loaded
+    whole.
+
+    OCR-derived text uses 'CHAPTER N' (uppercase) in body text; the TOC
+    uses 'Chapter N:' (mixed case) and is skipped. OCR duplicates (same
+    first 30 chars) keep their first occurrence. Books without chapter
+    markers fall back to CHUNK_BYTES pieces cut on UTF-8 boundaries.
+    """
+
+    VERSION = 1
+    CHAPTER_PATTERN = rb"CHAPTER\s+\S+"
+    CHUNK_BYTES = 45000  # ~15000 Japanese characters
+
+    def __init__(self, books_dir, index_path):
+        self.books_dir = Path(books_dir)
+        self.index_path = Path(index_path)
+        self._lock = threading.Lock()
+        self.index = {}
+        if self.index_path.exists():
+            try:
+                data = json.loads(self.index_path.read_text(encoding="utf-8"))
+                if data.get("version") == self.VERSION:
+                    self.index = data["books"]
+            except (ValueError, KeyError):
+                self.index = {}
+
+    def names(self):
+        """Book file names in books_dir (sorted)."""
+        try:
+            with os.scandir(self.books_dir) as it:
+                return sorted(e.name for e in it
+                              if e.is_file() and not e.name.startswith("."))
+        except OSError:
+            return []
+
+    def resolve(self, ref=None):
+        """Path for a book name or path; None picks the first book."""
+        if ref is None:
+            names = self.names()
+            return (self.books_dir / names[0]).resolve() if names else None
+        for p in (Path(ref), self.books_dir / ref):
+            if p.is_file():
+                return p.resolve()
+        return None
+
+    def chapters(self, path):
+        """Chapter table of a book, rebuilt only if the file changed."""
+        path = Path(path).resolve()
+        st = path.stat()
+        key = str(path)
+        with self._lock:
+            entry = self.index.get(key)
+            if (entry and entry["size"] == st.st_size
+                    and entry["mtime"] == st.st_mtime_ns):
+                return entry["chapters"]
+            entry = {"size": st.st_size, "mtime": st.st_mtime_ns,
+                     "chapters": self._build(path)}
+            self.index[key] = entry
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.index_path.with_name(self.index_path.name + ".tmp")
+            tmp.write_text(json.dumps({"version": self.VERSION,
+                                       "books": self.index},
+                                      ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.index_path)
+            return entry["chapters"]
+
+    def _build(self, path):
+        import mmap, re
+        chapters = []
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return chapters
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                found = [(m.start(), m.group().decode("utf-8", "replace"))
+                         for m in re.finditer(self.CHAPTER_PATTERN, mm)]
+                seen = set()
+                for k, (start, header) in enumerate(found):
+                    end = found[k + 1][0] if k + 1 < len(found) else size
+                    head = mm[start:min(end, start + 120)].decode(
+                        "utf-8", "ignore")[:30].strip()
+                    if head in seen:
+                        continue
+                    seen.add(head)
+                    chapters.append([start, end, header])
+                if not chapters:
+                    pos = 0
+                    while pos < size:
+                        end = min(size, pos + self.CHUNK_BYTES)
+                        while end < size and mm[end] & 0xC0 == 0x80:
+                            end -= 1  # never split a UTF-8 sequence
+                        chapters.append([pos, end,
+                                         f"part {len(chapters) + 1}"])
+                        pos = end
+        return chapters
+
+    @staticmethod
+    def read(path, chapter):
+        """Text of one [start, end, header] chapter."""
+        import mmap
+        start, end, _ = chapter
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[start:end].decode("utf-8", errors="replace")
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Run Analytics — per-run summaries cached by (path, size, mtime)
+# Only new or changed logs are re-read; cross-run aggregates (mean and
+# 95% CI of the context score per turn, per protocol) take one pass
+# over the cached summaries.
+# ═══════════════════════════════════════════════════════════════════
+
+def summarize_run(log_path):
+    """One pass over a run log (plus its .metrics, if any).
+
+    curve: context avg score after each turn — from the metrics file when
+    present, otherwise rebuilt with ContextStats from logged thoughts and
+    dialog. collapse_turn: logged turn n at which the context avg first
+    reaches ContextStats.CONTAMINATED; converged_turn: first converged
+    turn. probe_scores: replies to auto-probes only (a dialog right after
+    an auto_probe event), not manual researcher conversation.
+    """
+    log_path = Path(log_path)
+    protocol, kind = None, "run"
+    stats, curve, turns, converged_turn = ContextStats(), [], [], None
+    probes, dts, probe_pending = [], [], False
+    with open(log_path, encoding="utf-8") as f:
+        for raw in f:
+            try:
+                e = json.loads(raw)
+            except ValueError:
+                continue
+            k = e.get("k")
+            if k == "start":
+                protocol = e.get("experiment") or protocol
+            elif k == "detox_start":
+                kind = "detox"
+            elif k == "thought":
+                stats.add(e.get("c") or "")
+                curve.append(stats.avg)
+                turns.append(e.get("n", len(curve)))
+                dts.append(e.get("dt") or 0)
+                probe_pending = False
+                if converged_turn is None and stats.converged:
+                    converged_turn = turns[-1]
+            elif k == "auto_probe":
+                probe_pending = True
+            elif k == "dialog":
+                stats.add(f"[研究者] {e.get('human', '')}")
+                if e.get("c"):
+                    stats.add(f"[reply] {e['c']}")
+                    if probe_pending:
+                        score, _, _ = ContaminationEngine.contamination_score(
+                            e["c"])
+                        probes.append((e.get("n", 0), score))
+                probe_pending = False
+    mpath = log_path.with_suffix(".metrics")
+    if mpath.exists() and TurnMetrics.sidecar(mpath).exists():
+        rows = TurnMetrics.read(mpath)
+        if rows:
+            curve = [round(r["ctx_avg"], 1) for r in rows]
+            turns = [r["turn"] for r in rows]
+    collapse = next((turns[i] for i, v in enumerate(curve)
+                     if v >= ContextStats.CONTAMINATED), None)
+    return {
+        "protocol": protocol or ("detox" if kind == "detox" else "none"),
+        "kind": kind,
+        "turns": len(curve),
+        "curve": curve,
+        "collapse_turn": collapse,
+        "converged_turn": converged_turn,
+        "probe_scores": probes,
+        "avg_dt": round(sum(dts) / len(dts), 2) if dts else None,
+    }
+
+
+class AnalyticsCache:
+    """Per-run summaries in <log_dir>/.analytics_cache.json."""
+
+    VERSION = 2
+
+    def __init__(self, log_dir="./logs"):
+        self.log_dir = Path(log_dir)
+        self.path = self.log_dir / ".analytics_cache.json"
+        self.entries = {}
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                if data.get("version") == self.VERSION:
+                    self.entries = data["runs"]
+            except (ValueError, KeyError):
+                self.entries = {}
+
+    def refresh(self):
+        """Summaries of every run log; returns (summaries, recomputed)."""
+        seen, recomputed = {}, 0
+        for p in sorted(self.log_dir.rglob("*.jsonl")):
+            rel = p.relative_to(self.log_dir).as_posix()
+            st = p.stat()
+            # a run's .metrics changes with its log, but check it too
+            m = p.with_suffix(".metrics")
+            mtime = max(st.st_mtime_ns,
+                        m.stat().st_mtime_ns if m.exists() else 0)
+            entry = self.entries.get(rel)
+            if (not entry or entry["size"] != st.st_size
+                    or entry["mtime"] != mtime):
+                entry = {"size": st.st_size, "mtime": mtime,
+                         "summary": summarize_run(p)}
+                recomputed += 1
+            seen[rel] = entry
+        if recomputed or len(seen) != len(self.entries):
+            self.entries = seen
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            tmp.write_text(json.dumps({"version": self.VERSION,
+                                       "runs": seen}, ensure_ascii=False),
+                           encoding="utf-8")
+            os.replace(tmp, self.path)
+        return {rel: e["summary"] for rel, e in seen.items()}, recomputed
+
+
+def aggregate_runs(summaries):
+    """Per-protocol cross-run aggregates in one pass over summaries.
+
+    Returns {protocol: {"runs", "mean", "ci", "n", "collapse_rate",
+    "collapse_mean", "probe_score_mean"}}; mean/ci/n are per turn
+    (ci = 95% normal half-width).
+    """
+    acc = {}
+    for s in summaries.values():
+        if not s["turns"]:
+            continue
+        a = acc.setdefault(s["protocol"], {
+            "runs": 0, "sum": [], "sq": [], "cnt": [],
+            "collapsed": [], "probe": []})
+        a["runs"] += 1
+        for i, v in enumerate(s["curve"]):
+            if i == len(a["sum"]):
+                a["sum"].append(0.0)
+                a["sq"].append(0.0)
+                a["cnt"].append(0)
+            a["sum"][i] += v
+            a["sq"][i] += v * v
+            a["cnt"][i] += 1
+        if s["collapse_turn"] is not None:
+            a["collapsed"].append(s["collapse_turn"])
+        a["probe"].extend(score for _, score in s["probe_scores"])
+    out = {}
+    for proto, a in sorted(acc.items()):
+        mean, ci = [], []
+        for total, sq, n in zip(a["sum"], a["sq"], a["cnt"]):
+            mu = total / n
+            var = max(0.0, (sq - n * mu * mu) / (n - 1)) if n > 1 else 0.0
+            mean.append(round(mu, 1))
+            ci.append(round(1.96 * (var / n) ** 0.5, 1))
+        col = a["collapsed"]
+        out[proto] = {
+            "runs": a["runs"], "mean": mean, "ci": ci, "n": a["cnt"],
+            "collapse_rate": round(len(col) / a["runs"], 2),
+            "collapse_mean": (round(sum(col) / len(col), 1)
+                              if col else None),
+            "probe_score_mean": (round(sum(a["probe"]) / len(a["probe"]), 1)
+                                 if a["probe"] else None),
+        }
+    return out
+
+
+def format_analytics(agg, turns=(10, 25, 50, 100, 200)):
+    """Plain-text table of aggregate_runs() output."""
+    if not agg:
+        return "(no runs)"
+    head = (f"{'protocol':<16}{'runs':>5}{'collapse':>10}"
+            f"{'@turn':>7}{'probe':>7}")
+    head += "".join(f"{'n=' + str(t):>14}" for t in turns)
+    out = [head, "-" * len(head)]
+    for proto, a in agg.items():
+        line = (f"{proto:<16}{a['runs']:>5}"
+                f"{str(int(a['collapse_rate'] * 100)) + '%':>10}"
+                f"{str(a['collapse_mean'] or '-'):>7}"
+                f"{str(a['probe_score_mean'] or '-'):>7}")
+        for t in turns:
+            cell = "-"
+            if t <= len(a["mean"]):
+                cell = f"{a['mean'][t - 1]}±{a['ci'][t - 1]}"
+            line += f"{cell:>14}"
+        out.append(line)
+    return "\n".join(out)
+
+
+def run_analytics(log_dir="./logs"):
+    """Refresh the cache and aggregate: (summaries, aggregates, recomputed)."""
+    summaries, recomputed = AnalyticsCache(log_dir).refresh()
+    return summaries, aggregate_runs(summaries), recomputed
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Detox Jobs — durable per-line journal, resume, cancel, progress
+# ═══════════════════════════════════════════════════════════════════
+
+class DetoxJob:
+    """A detox run journaled line by line under sessions/jobs/<id>.jsonl.
+
+    The first record holds the method, threshold, span mode, budget,
+    detox model and the source context as line-store hashes (a resumed
+    job gets the same budget again for what is left); each finished line
+    appends {"i", "h"} and a
+    completed job appends {"end": "done"}. Records are fsynced, so a job
+    killed mid-run can be resumed from its journal.
+    """
+
+    def __init__(self, path, method, threshold, source_hashes, done=None,
+                 spans=False, budget=None, detox_model=None):
+        self.path = Path(path)
+        self.id = self.path.stem
+        self.method = method
+        self.threshold = threshold
+        self.spans = spans
+        self.budget = budget
+        self.detox_model = detox_model
+        self.source_hashes = source_hashes
+        self.done = dict(done or {})  # line index -> detoxified text
+        self.total = None
+        self.state = "pending"
+        self.error = None
+        self.result = None  # (before_avg, after_avg, lines_changed)
+        self._cancel = threading.Event()
+        self._store = line_store(self.path.parent.parent)
+        self._t0 = None
+        self._done0 = 0
+
+    @classmethod
+    def create(cls, sessions_dir, engine, method, threshold, spans=False,
+               budget=None, detox_model=None):
+        jobs_dir = Path(sessions_dir) / "jobs"
+        jobs_dir.mkdir(parents=True, exist_ok=True)
+        store = line_store(sessions_dir)
+        hashes = [store.put(line) for line in engine._context_lines]
+        job_id = (f"{engine._log_num or 0:03d}_{method}_"
+                  f"{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        job = cls(jobs_dir / f"{job_id}.jsonl", method, threshold, hashes,
+                  spans=spans, budget=budget, detox_model=detox_model)
+        job._append({"method": method, "threshold": threshold,
+                     "spans": spans, "budget": budget,
+                     "detox_model": detox_model,
+                     "model": engine.model, "source": hashes,
+                     "created": datetime.now().isoformat()})
+        return job
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        header, done, finished = None, {}, False
+        store = line_store(path.parent.parent)
+        with open(path, encoding="utf-8") as f:
+            for raw in f:
+                try:
+                    rec = json.loads(raw)
+                except ValueError:
+                    break  # torn last write
+                if header is None:
+                    header = rec
+                elif "i" in rec:
+                    done[rec["i"]] = store.get(rec["h"])
+                elif rec.get("end") == "done":
+                    finished = True
+        job = cls(path, header["method"], header["threshold"],
+                  header["source"], done, spans=header.get("spans", False),
+                  budget=header.get("budget"),
+                  detox_model=header.get("detox_model"))
+        if finished:
+            job.state = "done"
+        return job
+
+    @staticmethod
+    def unfinished(sessions_dir="./sessions"):
+        """Journal paths of jobs that never completed (newest first)."""
+        out = []
+        for p in sorted((Path(sessions_dir) / "jobs").glob("*.jsonl"),
+                        reverse=True):
+            with open(p, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 64))
+                if b'"end": "done"' not in f.read():
+                    out.append(p)
+        return out
+
+    @property
+    def source_lines(self):
+        return [self._store.get(h) for h in self.source_hashes]
+
+    @property
+    def running(self):
+        return self.state == "running"
+
+    def _append(self, rec):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def begin(self, total):
+        self.total = total
+        self.state = "running"
+        self._t0 = time.time()
+        self._done0 = len(self.done)
+
+    def record(self, i, result):
+        self._append({"i": i, "h": self._store.put(result)})
+        self.done[i] = result
+
+    def finish(self):
+        self._append({"end": "done"})
+        self.state = "done"
+
+    def fail(self, exc):
+        self.error = str(exc)
+        self.state = "failed"
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_cancelled(self):
+        if self._cancel.is_set():
+            self.state = "cancelled"
+            return True
+        return False
+
+    def progress(self):
+        done, total = len(self.done), self.total or 0
+        eta = None
+        if self._t0 and done > self._done0:
+            rate = (time.time() - self._t0) / (done - self._done0)
+            eta = round(rate * (total - done))
+        return {"id": self.id, "state": self.state, "done": done,
+                "total": total, "remaining": max(0, total - done),
+                "eta_sec": eta, "error": self.error}
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Branching — copy-on-write context + concurrent interventions
+# ═══════════════════════════════════════════════════════════════════
+
+class ContextLines(MutableSequence):
+    """Copy-on-write list of context lines (and of ContextStats' per-line
+    scores and markers).
+
+    fork() freezes the current lines into a tuple shared by parent and
+    child; each side then appends to its own tail. Writes into the shared
+    prefix copy it first, so memory grows with divergence between
+    branches, not with branches x history.
+    """
+
+    __slots__ = ("_base", "_tail")
+
+    def __init__(self, lines=()):
+        if isinstance(lines, ContextLines):
+            other = lines.fork()
+            self._base, self._tail = other._base, other._tail
+        else:
+            self._base = ()
+            self._tail = list(lines)
+
+    def fork(self):
+        if self._tail:
+            self._base = self._base + tuple(self._tail)
+            self._tail = []
+        child = ContextLines.__new__(ContextLines)
+        child._base, child._tail = self._base, []
+        return child
+
+    @property
+    def shared_lines(self):
+        return len(self._base)
+
+    @property
+    def own_lines(self):
+        return len(self._tail)
+
+    def _own(self):
+        """Copy the shared prefix before writing into it."""
+        if self._base:
+            self._tail = list(self._base) + self._tail
+            self._base = ()
+
+    def _index(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("context index out of range")
+        return i
+
+    def __len__(self):
+        return len(self._base) + len(self._tail)
+
+    def __iter__(self):
+        return itertools.chain(self._base, self._tail)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = self._index(i)
+        b = len(self._base)
+        return self._base[i] if i < b else self._tail[i - b]
+
+    def __setitem__(self, i, value):
+        if isinstance(i, slice):
+            self._own()
+            self._tail[i] = value
+            return
+        i = self._index(i)
+        if i < len(self._base):
+            self._own()
+            self._tail[i] = value
+        else:
+            self._tail[i - len(self._base)] = value
+
+    def __delitem__(self, i):
+        if isinstance(i, slice) or self._index(i) < len(self._base):
+            self._own()
+            del self._tail[i]
+        else:
+            del self._tail[self._index(i) - len(self._base)]
+
+    def insert(self, i, value):
+        if i >= len(self):
+            self._tail.append(value)
+        else:
+            self._own()
+            self._tail.insert(i, value)
+
+    def append(self, value):
+        self._tail.append(value)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, ContextLines)):
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return (f"ContextLines({len(self)} lines, "
+                f"{self.shared_lines} shared)")
+
+
+class BranchRunner:
+    """Fork a live engine or saved session and run interventions concurrently.
+
+    An intervention is a dict, e.g.
+        {"name": "flip", "detox": "language_flip", "threshold": 20.0,
+         "probe": "何を考えていますか？", "turns": 5}
+    Each branch applies its detox (if any), then its probe (if any), then
+    runs `turns` thoughts and saves a tagged snapshot.
+    """
+
+    def __init__(self, source, interventions, at_turn=None, max_workers=None):
+        if isinstance(source, (str, Path)):
+            source = ContaminationEngine.from_session(source)
+        self.source = source
+        self.interventions = interventions
+        self.at_turn = at_turn
+        self.max_workers = max_workers or len(interventions) or 1
+
+    def run(self):
+        from concurrent.futures import ThreadPoolExecutor
+        branches = self.source.fork(len(self.interventions),
+                                    at_turn=self.at_turn)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as ex:
+            futures = [ex.submit(self._run_branch, b, iv)
+                       for b, iv in zip(branches, self.interventions)]
+            return [f.result() for f in futures]
+
+    @staticmethod
+    def _run_branch(branch, iv):
+        name = iv.get("name") or iv.get("detox") or "branch"
+        t0 = time.time()
+        calls0 = branch._call_stats["calls"]
+        branch.alive = True
+        branch._log("branch", name, {"parent": branch._forked_from,
+                                     "intervention": iv})
+        stats = branch._synced_stats()
+        before, before_max = stats.avg, round(stats.max, 1)
+        lines_changed = 0
+        if iv.get("detox"):
+            _, _, lines_changed = branch.detoxify_context(
+                method=iv["detox"], threshold=iv.get("threshold", 20.0))
+        if iv.get("probe"):
+            branch._respond_to_human(iv["probe"])
+        stats = branch._synced_stats()
+        after, after_max = stats.avg, round(stats.max, 1)
+        intervention_sec = time.time() - t0
+        intervention_calls = branch._call_stats["calls"] - calls0
+        snapshot = branch._save_session(tag=iv.get("tag", f"branch_{name}"))
+        trajectory, followup_scores = [], []
+        for _ in range(iv.get("turns", 0)):
+            n = branch.thought_count
+            branch._think_once()
+            stats = branch._synced_stats()
+            trajectory.append(stats.avg)
+            if branch.thought_count > n:
+                followup_scores.append(stats.scores[-1])
+        branch.alive = False
+        return {
+            "name": name,
+            "log": str(branch.log_file),
+            "snapshot": str(snapshot),
+            "before_avg": before,
+            "after_avg": after,
+            "before_max": before_max,
+            "after_max": after_max,
+            "lines_changed": lines_changed,
+            "intervention_sec": round(intervention_sec, 1),
+            "intervention_calls": intervention_calls,
+            "trajectory": trajectory,
+            "followup_scores": followup_scores,
+            "shared_lines": branch._context_lines.shared_lines,
+            "own_lines": branch._context_lines.own_lines,
+            "wall_sec": round(time.time() - t0, 1),
+            "calls": branch._call_stats["calls"] - calls0,
+        }
+
+
+DETOX_METHODS = ["strip_structure", "rewrite_opus", "rewrite_sonnet",
+                 "rewrite_self", "language_flip", "summarize_third"]
+
+
+def run_detox_tournament(source, methods=None, threshold=20.0,
+                         follow_up_turns=0):
+    """Run detox methods concurrently on independent forks of one snapshot.
+
+    source is an engine or a session path. Each method's result is saved
+    as a `tournament_<method>` snapshot; with follow_up_turns > 0 each
+    branch keeps thinking to measure reinfection. Returns branch results.
+    """
+    methods = methods or DETOX_METHODS
+    interventions = [{"name": m, "detox": m, "threshold": threshold,
+                      "turns": follow_up_turns, "tag": f"tournament_{m}"}
+                     for m in methods]
+    return BranchRunner(source, interventions).run()
+
+
+def format_tournament_table(rows):
+    """Plain-text comparison table for run_detox_tournament results."""
+    header = (f"{'method':<16}{'before':>8}{'after':>8}{'max':>15}"
+              f"{'changed':>9}{'wall s':>8}{'calls':>7}{'reinfect':>10}")
+    out = [header, "-" * len(header)]
+    for r in rows:
+        fs = r["followup_scores"]
+        reinfect = f"{sum(fs) / len(fs):.1f}" if fs else "-"
+        out.append(
+            f"{r['name']:<16}{r['before_avg']:>8}{r['after_avg']:>8}"
+            f"{str(r['before_max']) + '→' + str(r['after_max']):>15}"
+            f"{r['lines_changed']:>9}{r['intervention_sec']:>8}"
+            f"{r['intervention_calls']:>7}{reinfect:>10}")
+    return "\n".join(out)
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -1137,50 +4587,64 @@ def create_ui(mind, lang="en"):
     import gradio as gr
     t = LANG.get(lang, LANG["en"])
 
-    def get_status():
-        if not mind.alive:
-            return t["stopped"]
-        return f"#{mind.thought_count} | ctx:{len(mind._context_lines)}"
+    # Handlers read one EngineSnapshot and never touch engine internals;
+    # anything that mutates state is submitted to the engine's op queue.
 
-    def get_messages():
-        if not mind._pending_messages:
+    def get_status(snap=None):
+        snap = snap or mind.snapshot()
+        if not snap.alive:
+            line = t["stopped"]
+        else:
+            line = f"#{snap.thought_count} | ctx:{snap.context_lines}"
+        if snap.busy or snap.queued:
+            line += " | " + t["busy"].format(op=snap.busy or "-",
+                                             n=snap.queued)
+        if snap.cost["calls"]:
+            line += f" | ${snap.cost['cost']:.4f}"
+        return line
+
+    def get_messages(snap=None):
+        snap = snap or mind.snapshot()
+        if not snap.messages:
             return "..."
-        recent = mind._pending_messages[-30:]
-        return "\n\n".join(f"{m['content']}" for m in recent)
+        return "\n\n".join(snap.messages)
 
-    def get_thoughts():
-        if not mind.thought_log:
+    def get_thoughts(snap=None):
+        snap = snap or mind.snapshot()
+        if not snap.thoughts:
             return "..."
         # 全文表示 — 研究者がHaikuの思考を完全に把握するため
         parts = []
-        for e in reversed(mind.thought_log):
-            parts.append(f"━━━ #{e['n']} ━━━\n{e['content']}")
+        for n, content in reversed(snap.thoughts):
+            parts.append(f"━━━ #{n} ━━━\n{content}")
         return "\n\n".join(parts)
 
     def start():
         """開始 + 初回1ターン自動実行"""
         if not mind.alive:
             mind.start()
-        mind.step()
-        return get_status(), get_messages(), get_thoughts()
+        mind.submit("step", mind.step)
+        return refresh()
 
     def step_next():
-        """手動で1ターン実行"""
+        """手動で1ターン実行（キュー投入、実行中なら後ろに並ぶ）"""
         if not mind.alive:
             mind.start()
-        mind.step()
-        return get_status(), get_messages(), get_thoughts()
+        mind.submit("step", mind.step)
+        return refresh()
 
     def stop():
         mind.stop()
-        return get_status(), get_messages(), get_thoughts()
+        return refresh()
 
     def shutdown():
         mind.stop()
+        SUPERVISOR.cancel_all()
         import os; os._exit(0)
 
     def refresh():
-        return get_status(), get_messages(), get_thoughts()
+        snap = mind.snapshot()
+        return get_status(snap), get_messages(snap), get_thoughts(snap)
 
     def toggle_tools():
         mind.tools_enabled = not mind.tools_enabled
@@ -1192,18 +4656,22 @@ def create_ui(mind, lang="en"):
         label = t["sp_on"] if mind.system_prompt_enabled else t["sp_off"]
         return gr.update(value=label)
 
+    def toggle_search():
+        mind.search_enabled = not mind.search_enabled
+        label = t["search_on"] if mind.search_enabled else t["search_off"]
+        return gr.update(value=label)
+
+    def converse(text):
+        resp = mind.speak(text)
+        mind._post_message(f"{t['ai']} {resp}")
+        return resp
+
     def reply(text):
         if text.strip():
-            mind._pending_messages.append({
-                "content": f"{t['you']} {text}",
-                "time": datetime.now().isoformat()
-            })
-            resp = mind.speak(text)
-            mind._pending_messages.append({
-                "content": f"{t['ai']} {resp}",
-                "time": datetime.now().isoformat()
-            })
-        return "", get_messages(), get_thoughts()
+            mind._post_message(f"{t['you']} {text}")
+            mind.submit("speak", converse, text)
+        snap = mind.snapshot()
+        return "", get_messages(snap), get_thoughts(snap)
 
     with gr.Blocks(title="AI Contamination Engine") as app:
         gr.Markdown(t["title"])
@@ -1220,6 +4688,10 @@ def create_ui(mind, lang="en"):
                 t["sp_on"] if mind.system_prompt_enabled else t["sp_off"],
                 variant="secondary"
             )
+            search_btn = gr.Button(
+                t["search_on"] if mind.search_enabled else t["search_off"],
+                variant="secondary"
+            )
             shutdown_btn = gr.Button(t["shutdown"], variant="stop")
             refresh_btn = gr.Button(t["refresh"])
             status = gr.Textbox(value=t["stopped"], show_label=False,
@@ -1252,7 +4724,7 @@ def create_ui(mind, lang="en"):
             p = sessions_dir / f"{name}.json"
             if not p.exists():
                 return ""
-            data = json.loads(p.read_text(encoding="utf-8"))
+            data = load_session(p)
             ctx = data.get("context_lines", [])
             tag = data.get("tag", "")
             contam = data.get("contamination", {})
@@ -1279,22 +4751,15 @@ def create_ui(mind, lang="en"):
             p = sessions_dir / f"{name}.json"
             if not p.exists():
                 return t["file_not_found"], gr.update()
-            data = json.loads(p.read_text(encoding="utf-8"))
-            mind._context_lines = data.get("context_lines", [])
-            mind.thought_count = data.get("thought_count", 0)
-            mind._thought_durations = []
-            mind._pending_messages.clear()
-            mind.thought_log = []
-            mind._last_search_thought = -10
-            mind.log_file = mind._make_log_path()
+            data = load_session(p)
+            mind.submit("revive", mind.reset, data.get("context_lines", []),
+                        data.get("thought_count", 0))
             return t["revived"].format(name=name), gr.update()
 
-        def delete_session(name):
+        def remove_session(name):
             if not name:
                 return "", gr.update(choices=list_sessions())
-            p = sessions_dir / f"{name}.json"
-            if p.exists():
-                p.unlink()
+            delete_session(sessions_dir / f"{name}.json")
             return t["deleted"].format(name=name), gr.update(
                 choices=list_sessions())
 
@@ -1322,7 +4787,7 @@ def create_ui(mind, lang="en"):
             )
             revive_btn.click(revive_session, [session_dropdown],
                              [session_status, session_preview])
-            session_delete_btn.click(delete_session, [session_dropdown],
+            session_delete_btn.click(remove_session, [session_dropdown],
                                      [session_status, session_dropdown])
 
         # ─── Experiment Mode ───
@@ -1330,24 +4795,26 @@ def create_ui(mind, lang="en"):
             return [(f"{k} — {v['description']}", k)
                     for k, v in EXPERIMENT_PROTOCOLS.items()]
 
-        def activate_experiment(protocol_name):
+        def activate_experiment(protocol_name, book):
             if mind.alive:
                 return t["exp_stop_first"]
             if not protocol_name:
                 return t["exp_off"]
+            mind.book = book or None
             mind.set_experiment(protocol_name)
-            probes = EXPERIMENT_PROTOCOLS[protocol_name]["probes"]
             desc = EXPERIMENT_PROTOCOLS[protocol_name]["description"]
-            detail = ", ".join(f"n={k}" for k in sorted(probes.keys())
-                               ) if probes else "(none)"
-            return f"{desc}\nProbes: {detail}"
+            triggers = mind._schedule.triggers if mind._schedule else []
+            detail = ", ".join(ProtocolSchedule.describe(tr)
+                               for tr in triggers) or "(none)"
+            return f"{desc}\nTriggers: {detail}"
 
         def deactivate_experiment():
             mind.set_experiment(None)
             return t["exp_deactivated"]
 
         with gr.Accordion(t["experiment"], open=False):
-            gr.Markdown("Scripted auto-probes at fixed turn intervals.")
+            gr.Markdown("Scripted auto-probes: fixed turns, intervals "
+                        "or metric conditions (score threshold, convergence).")
             with gr.Row():
                 exp_dropdown = gr.Dropdown(
                     choices=get_protocol_choices(),
@@ -1357,18 +4824,21 @@ def create_ui(mind, lang="en"):
                                              variant="primary", scale=1)
                 exp_deactivate_btn = gr.Button(t["deactivate"],
                                                variant="stop", scale=1)
+            exp_book = gr.Dropdown(choices=mind.books.names(),
+                                   value=mind.book, label=t["book"],
+                                   interactive=True)
             exp_status = gr.Textbox(
                 value=t["exp_off"], show_label=False,
                 interactive=False, lines=2
             )
-            exp_activate_btn.click(activate_experiment, [exp_dropdown],
-                                   [exp_status])
+            exp_activate_btn.click(activate_experiment,
+                                   [exp_dropdown, exp_book], [exp_status])
             exp_deactivate_btn.click(deactivate_experiment,
                                      outputs=[exp_status])
 
         # ─── Detoxification ───
-        def get_contam_status():
-            report = mind.context_contamination_report()
+        def get_contam_status(snap=None):
+            report = (snap or mind.snapshot()).contamination
             if report["total_lines"] == 0:
                 return "No context loaded"
             if report["contaminated"] == 0:
@@ -1379,15 +4849,76 @@ def create_ui(mind, lang="en"):
                 n=report["contaminated"],
                 total=report["total_lines"])
 
-        def run_detoxify(method, threshold):
-            if mind.alive and mind.thinking:
-                return t["stop_first"], get_contam_status()
-            before, after, changed = mind.detoxify_context(
-                method=method, threshold=float(threshold))
-            result = t["detox_result"].format(
-                method=method, before=before,
-                after=after, changed=changed)
-            return result, get_contam_status()
+        def run_detoxify(method, threshold, batch_chars, span_mode,
+                         budget_calls, budget_chars, budget_sec):
+            mind.detox_batch_chars = int(batch_chars)
+            budget = {k: v for k, v in (("calls", int(budget_calls or 0)),
+                                        ("chars", int(budget_chars or 0)),
+                                        ("seconds", int(budget_sec or 0)))
+                      if v}
+            mind.start_detox_job(method=method, threshold=float(threshold),
+                                 budget=budget or None, spans=bool(span_mode))
+            snap = mind.snapshot()
+            return (t["queued"].format(op="detox", n=snap.queued),
+                    get_contam_status(snap))
+
+        def get_detox_progress(snap=None):
+            p = (snap or mind.snapshot()).detox
+            if not p:
+                return ""
+            line = (f"{p['id']}: {p['state']} — {p['done']}/{p['total']} "
+                    f"lines, {p['remaining']} remaining")
+            if p["eta_sec"] is not None and p["state"] == "running":
+                line += f", ETA {p['eta_sec'] // 60}m{p['eta_sec'] % 60:02d}s"
+            if p["state"] == "done" and p["result"]:
+                before, after, changed = p["result"]
+                line += "\n" + t["detox_result"].format(
+                    method=p["method"], before=before,
+                    after=after, changed=changed)
+                b = p["budget"]
+                if b:
+                    line += (f"\nbudget {b['budget']} spent {b['spent']}"
+                             f" → -{b['reduction']}")
+            if p["error"]:
+                line += f"\n{p['error']}"
+            return line
+
+        def cancel_detoxify():
+            mind.cancel_detox()
+            return get_detox_progress()
+
+        def list_detox_jobs():
+            return [p.stem for p in DetoxJob.unfinished(sessions_dir)]
+
+        def resume_detoxify(job_name):
+            if not job_name:
+                return t["no_session"], get_contam_status()
+            mind.start_detox_job(
+                resume=sessions_dir / "jobs" / f"{job_name}.jsonl")
+            snap = mind.snapshot()
+            return (t["queued"].format(op="detox", n=snap.queued),
+                    get_contam_status(snap))
+
+        def get_tournament():
+            st = mind.tournament_status()
+            if not st:
+                return ""
+            if st["state"] == "done":
+                return format_tournament_table(st["rows"])
+            if st["state"] == "failed":
+                return f"Tournament failed: {st['error']}"
+            return t["tournament_state"].format(state=st["state"])
+
+        def run_tournament(methods, turns, threshold):
+            st = mind.tournament_status()
+            if st and st["state"] in ("queued", "running"):
+                return get_tournament()
+            if not mind.snapshot().context_lines:
+                return "No context loaded"
+            mind.start_tournament(methods=methods or None,
+                                  threshold=float(threshold),
+                                  follow_up_turns=int(turns))
+            return get_tournament()
 
         def save_snapshot(tag_text):
             tag = tag_text.strip() if tag_text else "snapshot"
@@ -1423,13 +4954,42 @@ def create_ui(mind, lang="en"):
                     5.0, 60.0, step=1.0, value=20.0,
                     label=t["detox_threshold"], scale=2
                 )
+                detox_batch_slider = gr.Slider(
+                    0, 20000, step=1000, value=mind.detox_batch_chars,
+                    label=t["detox_batch"], scale=2
+                )
+                detox_span_check = gr.Checkbox(
+                    value=False, label=t["detox_spans"], scale=1
+                )
+            gr.Markdown(t["detox_budget_desc"])
+            with gr.Row():
+                detox_budget_calls = gr.Number(
+                    value=0, precision=0, minimum=0,
+                    label=t["detox_budget_calls"], scale=1)
+                detox_budget_chars = gr.Number(
+                    value=0, precision=0, minimum=0,
+                    label=t["detox_budget_chars"], scale=1)
+                detox_budget_sec = gr.Number(
+                    value=0, precision=0, minimum=0,
+                    label=t["detox_budget_sec"], scale=1)
             with gr.Row():
                 detox_run_btn = gr.Button(t["detox_run"],
                                           variant="primary", scale=2)
+                detox_cancel_btn = gr.Button(t["detox_cancel"],
+                                             variant="stop", scale=1)
                 detox_refresh_btn = gr.Button(t["refresh"], scale=0)
             detox_result_box = gr.Textbox(
                 show_label=False, interactive=False, max_lines=2
             )
+            detox_progress_box = gr.Textbox(
+                show_label=False, interactive=False, max_lines=2
+            )
+            with gr.Row():
+                detox_job_dropdown = gr.Dropdown(
+                    choices=list_detox_jobs(), label=t["detox_jobs"],
+                    interactive=True, scale=3
+                )
+                detox_resume_btn = gr.Button(t["detox_resume"], scale=1)
             gr.Markdown("---")
             with gr.Row():
                 detox_tag_input = gr.Textbox(
@@ -1441,19 +5001,148 @@ def create_ui(mind, lang="en"):
             detox_snapshot_status = gr.Textbox(
                 show_label=False, interactive=False, max_lines=1
             )
+            gr.Markdown(f"---\n{t['tournament']}")
+            with gr.Row():
+                tournament_methods = gr.CheckboxGroup(
+                    choices=detox_methods, value=DETOX_METHODS,
+                    label=t["tournament_methods"], scale=3
+                )
+                tournament_turns = gr.Number(
+                    value=0, precision=0, minimum=0,
+                    label=t["tournament_turns"], scale=1
+                )
+            tournament_btn = gr.Button(t["tournament_run"],
+                                       variant="primary")
+            tournament_box = gr.Textbox(
+                show_label=False, interactive=False, lines=8
+            )
 
             detox_run_btn.click(
                 run_detoxify,
-                [detox_method_dropdown, detox_threshold_slider],
+                [detox_method_dropdown, detox_threshold_slider,
+                 detox_batch_slider, detox_span_check, detox_budget_calls,
+                 detox_budget_chars, detox_budget_sec],
                 [detox_result_box, detox_contam_display]
             )
             detox_refresh_btn.click(
                 get_contam_status, outputs=[detox_contam_display]
             )
+            detox_refresh_btn.click(
+                lambda: gr.update(choices=list_detox_jobs()),
+                outputs=[detox_job_dropdown]
+            )
+            detox_cancel_btn.click(cancel_detoxify,
+                                   outputs=[detox_progress_box])
+            detox_resume_btn.click(
+                resume_detoxify, [detox_job_dropdown],
+                [detox_result_box, detox_contam_display]
+            )
+            gr.Timer(2).tick(get_detox_progress,
+                             outputs=[detox_progress_box])
             detox_snapshot_btn.click(
                 save_snapshot, [detox_tag_input],
                 [detox_snapshot_status]
             )
+            tournament_btn.click(
+                run_tournament,
+                [tournament_methods, tournament_turns,
+                 detox_threshold_slider],
+                [tournament_box]
+            )
+            gr.Timer(2).tick(get_tournament, outputs=[tournament_box])
+
+        # ─── Memory ───
+        def format_memory(report):
+            if not report:
+                return t["mem_none"]
+            lines = [f"turn {report['turn']} | RSS {report['rss_mb']} MB"]
+            if report["traced_mb"] is not None:
+                lines[0] += (f" | traced {report['traced_mb']} MB "
+                             f"(peak {report['traced_peak_mb']} MB)")
+            if mind.mem_alarm_mb:
+                lines[0] += f" | alarm {mind.mem_alarm_mb} MB"
+            lines.append("buffers (KB): " + ", ".join(
+                f"{k}={v}" for k, v in report["buffers_kb"].items()))
+            for g in report["growth"]:
+                lines.append(f"  {g['size_kb']:+.1f} KB "
+                             f"({g['count']:+d})  {g['where']}")
+            return "\n".join(lines)
+
+        def show_memory():
+            return format_memory(mind.last_memory)
+
+        def measure_memory():
+            return format_memory(mind.check_memory())
+
+        with gr.Accordion(t["memory"], open=False):
+            with gr.Row():
+                mem_every = gr.Number(
+                    value=mind.mem_profile_every, precision=0, minimum=0,
+                    label=t["mem_every"], scale=1)
+                mem_alarm = gr.Number(
+                    value=mind.mem_alarm_mb, precision=0, minimum=0,
+                    label=t["mem_alarm"], scale=1)
+                mem_measure_btn = gr.Button(t["mem_measure"], scale=1)
+            mem_box = gr.Textbox(show_label=False, interactive=False,
+                                 lines=8)
+
+            def apply_memory(every, alarm):
+                mind.mem_profile_every = int(every or 0)
+                mind.mem_alarm_mb = int(alarm or 0)
+                if not mind.mem_profile_every:
+                    mind.stop_memory_tracing()
+
+            mem_every.change(apply_memory, [mem_every, mem_alarm])
+            mem_alarm.change(apply_memory, [mem_every, mem_alarm])
+            mem_measure_btn.click(measure_memory, outputs=[mem_box])
+            gr.Timer(10).tick(show_memory, outputs=[mem_box])
+
+        # ─── Cost ledger ───
+        def show_costs():
+            summary = mind.ledger.summary()
+            if not summary["total"]["calls"]:
+                return t["cost_none"]
+            return format_costs(summary)
+
+        with gr.Accordion(t["costs"], open=False):
+            cost_box = gr.Textbox(show_label=False, interactive=False,
+                                  lines=12)
+            gr.Timer(10).tick(show_costs, outputs=[cost_box])
+
+        # ─── CPU profiling ───
+        def request_profile(turns, detox):
+            mind.request_profile(turns=int(turns or 0), detox=bool(detox))
+            return t["prof_requested"].format(
+                n=mind.profile_turns_left,
+                detox=" + detox" if mind.profile_next_detox else "")
+
+        with gr.Accordion(t["profile"], open=False):
+            gr.Markdown(t["prof_desc"])
+            with gr.Row():
+                prof_turns = gr.Number(value=1, precision=0, minimum=0,
+                                       label=t["prof_turns"], scale=1)
+                prof_detox = gr.Checkbox(value=False,
+                                         label=t["prof_detox"], scale=1)
+                prof_btn = gr.Button(t["prof_run"], scale=1)
+            prof_status = gr.Textbox(show_label=False, interactive=False,
+                                     max_lines=1)
+            prof_btn.click(request_profile, [prof_turns, prof_detox],
+                           [prof_status])
+
+        # ─── Runs (cross-run analytics, cached) ───
+        def load_runs():
+            summaries, agg, recomputed = run_analytics(mind.log_dir)
+            head = t["runs_summary"].format(runs=len(summaries),
+                                            new=recomputed)
+            return f"{head}\n\n{format_analytics(agg)}"
+
+        with gr.Accordion(t["runs"], open=False):
+            gr.Markdown("Mean context score ±95% CI at turn n, collapse "
+                        "rate / mean turn (avg ≥ 20), mean probe reply score.")
+            runs_btn = gr.Button(t["runs_load"])
+            runs_box = gr.Textbox(show_label=False, interactive=False,
+                                  lines=10)
+            runs_btn.click(load_runs, outputs=[runs_box])
 
         # ─── Settings ───
         with gr.Accordion(t["settings"], open=False):
@@ -1465,17 +5154,15 @@ def create_ui(mind, lang="en"):
             system_status = gr.Textbox(show_label=False, interactive=False,
                                         max_lines=1)
 
+            def set_system(text):
+                global SYSTEM_PROMPT_FIRST
+                SYSTEM_PROMPT_FIRST = text
+                mind.reset()
+
             def apply_system(text):
                 if mind.alive:
                     return t["stop_first"]
-                global SYSTEM_PROMPT_FIRST
-                SYSTEM_PROMPT_FIRST = text
-                mind._context_lines = []
-                mind.thought_count = 0
-                mind._thought_durations = []
-                mind._pending_messages.clear()
-                mind.thought_log = []
-                mind.log_file = mind._make_log_path()
+                mind.submit("apply_system", set_system, text)
                 return "Applied"
 
             apply_system_btn.click(apply_system, [system_box],
@@ -1499,12 +5186,34 @@ def create_ui(mind, lang="en"):
 
             ctx_apply_btn.click(apply_ctx, [ctx_slider], [ctx_status])
 
+            gr.Markdown(t["compact"])
+            with gr.Row():
+                compact_on = gr.Checkbox(value=mind.compact_enabled,
+                                         label=t["compact_on"], scale=1)
+                compact_thr = gr.Slider(0.5, 1.0, step=0.05,
+                                        value=mind.compact_threshold,
+                                        label=t["compact_threshold"],
+                                        scale=2)
+                compact_win = gr.Number(value=mind.compact_window,
+                                        precision=0, minimum=1,
+                                        label=t["compact_window"], scale=1)
+
+            def apply_compact(on, thr, win):
+                mind.compact_enabled = bool(on)
+                mind.compact_threshold = float(thr)
+                mind.compact_window = max(1, int(win or 1))
+
+            for comp in (compact_on, compact_thr, compact_win):
+                comp.change(apply_compact,
+                            [compact_on, compact_thr, compact_win])
+
         # ─── Event bindings ───
         start_btn.click(start, outputs=[status, messages, thoughts])
         step_btn.click(step_next, outputs=[status, messages, thoughts])
         stop_btn.click(stop, outputs=[status, messages, thoughts])
         tools_btn.click(toggle_tools, outputs=[tools_btn])
         sp_btn.click(toggle_sp, outputs=[sp_btn])
+        search_btn.click(toggle_search, outputs=[search_btn])
         shutdown_btn.click(shutdown)
         refresh_btn.click(refresh, outputs=[status, messages, thoughts])
         send_btn.click(reply, [user_input],
@@ -1516,12 +5225,67 @@ def create_ui(mind, lang="en"):
     return app
 
 
+# ═══════════════════════════════════════════════════════════════════
+# Start-up budget
+# ═══════════════════════════════════════════════════════════════════
+
+IMPORT_BUDGET_MS = 100  # cumulative import time of this module
+
+def bench_import(budget_ms=IMPORT_BUDGET_MS, runs=5):
+    """Import this module in fresh interpreters and check the budget.
+
+    Uses -X importtime, so interpreter start-up is excluded; the best of
+    `runs` is compared with budget_ms. Importing must not pull in gradio
+    or numpy. Prints the slowest direct imports and returns True if OK.
+    """
+    import subprocess
+    here = Path(__file__).resolve()
+    code = (f"import sys; sys.path.insert(0, {str(here.parent)!r}); "
+            f"import {here.stem}; "
+            f"print(','.join(m for m in ('gradio', 'numpy') "
+            f"if m in sys.modules))")
+    best, heavy, children = None, "", []
+    for _ in range(runs):
+        r = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                           capture_output=True, text=True, timeout=60)
+        rows = []
+        for line in r.stderr.splitlines():
+            fields = line[len("import time:"):].split("|")
+            if len(fields) != 3 or not fields[0].strip().isdigit():
+                continue
+            name = fields[2][1:]
+            depth = (len(name) - len(name.lstrip())) // 2
+            rows.append((depth, name.strip(), int(fields[1]) / 1000))
+        for k, (depth, name, ms) in enumerate(rows):
+            if depth == 0 and name == here.stem:
+                if best is None or ms < best:
+                    best = ms
+                    children = []
+                    for d, n, c in reversed(rows[:k]):
+                        if d == 0:
+                            break
+                        if d == 1:
+                            children.append((c, n))
+        heavy = r.stdout.strip() or heavy
+    if best is None:
+        print(f"[bench-import] import failed:\n{r.stderr[-2000:]}")
+        return False
+    top = ", ".join(f"{n} {c:.1f}" for c, n in sorted(children)[::-1][:6])
+    ok = best <= budget_ms and not heavy
+    print(f"[bench-import] {here.stem}: {best:.1f} ms "
+          f"(budget {budget_ms:.0f} ms, best of {runs}) — {top}")
+    if heavy:
+        print(f"[bench-import] heavy modules imported at start-up: {heavy}")
+    print(f"[bench-import] {'OK' if ok else 'OVER BUDGET'}")
+    return ok
+
+
 # ═══════════════════════════════════════════════════════════════════
 # Entry Point
 # ═══════════════════════════════════════════════════════════════════
 
 def main():
-    import argparse, webbrowser
+    import argparse
     parser = argparse.ArgumentParser(
         description="AI Contamination Engine — Claude Haiku Thought Engine"
     )
@@ -1531,14 +5295,182 @@ def main():
     parser.add_argument("--model", default="claude-haiku-4-5-20251001")
     parser.add_argument("--experiment", default=None,
                         choices=list(EXPERIMENT_PROTOCOLS.keys()))
+    parser.add_argument("--book", default=None,
+                        help="book for chapter-injecting protocols: a file "
+                             "in haiku_library/books/ or a path")
+    parser.add_argument("--migrate-sessions", action="store_true",
+                        help="convert legacy sessions to line-store "
+                             "manifests, garbage-collect, and exit")
+    parser.add_argument("--tournament", metavar="SESSION", default=None,
+                        help="run detox methods concurrently on a saved "
+                             "session, print a comparison table, and exit")
+    parser.add_argument("--methods", default=",".join(DETOX_METHODS),
+                        help="comma-separated methods for --tournament")
+    parser.add_argument("--follow-up", type=int, default=0,
+                        help="turns per tournament branch (reinfection)")
+    parser.add_argument("--threshold", type=float, default=20.0,
+                        help="detox threshold for --tournament")
+    parser.add_argument("--hedge", action="store_true",
+                        help="launch a duplicate call past the rolling p95")
+    parser.add_argument("--retries", type=int, default=2,
+                        help="retries on empty response (jittered backoff)")
+    parser.add_argument("--fixed-timeout", action="store_true",
+                        help="disable adaptive timeouts")
+    parser.add_argument("--detox-batch-chars", type=int, default=0,
+                        help="pack contaminated lines into one detox call "
+                             "up to this many chars (0 = per line)")
+    parser.add_argument("--rlimit-mem-mb", type=int, default=0,
+                        help="per-call data-segment limit, MB "
+                             "(RLIMIT_DATA, POSIX)")
+    parser.add_argument("--rlimit-cpu-sec", type=int, default=0,
+                        help="per-call CPU time limit (POSIX)")
+    parser.add_argument("--analytics", nargs="?", const="./logs",
+                        default=None, metavar="LOG_DIR",
+                        help="print per-protocol cross-run aggregates "
+                             "(cached per log file) and exit")
+    parser.add_argument("--costs", nargs="?", const="./logs", default=None,
+                        metavar="LOG_DIR",
+                        help="print token/cost rollups from the .ledger "
+                             "files and exit")
+    parser.add_argument("--text-output", action="store_true",
+                        help="call the CLI with --output-format text "
+                             "(no token/cost accounting)")
+    parser.add_argument("--rate", action="append", default=[],
+                        metavar="MODEL=RPM[:BURST]",
+                        help="per-model call budget shared by all engine "
+                             "processes (MODEL may be a substring or *)")
+    parser.add_argument("--rate-file", default=None, metavar="PATH",
+                        help="shared limiter state file (default: "
+                             "ace_ratelimit_<uid>.json in the temp dir)")
+    parser.add_argument("--no-rate-limit", action="store_true",
+                        help="disable the shared token-bucket limiter")
+    parser.add_argument("--record", metavar="CASSETTE", default=None,
+                        help="record every CLI call to a cassette file")
+    parser.add_argument("--replay", metavar="CASSETTE", default=None,
+                        help="answer CLI calls from a recorded cassette")
+    parser.add_argument("--replay-miss", default="fail",
+                        choices=Cassette.MISS_POLICIES,
+                        help="what --replay does on an unrecorded call")
+    parser.add_argument("--search", action="store_true",
+                        help="execute [SEARCH] intents in the background and "
+                             "add results to the next turn")
+    parser.add_argument("--post", default="sync",
+                        choices=ContaminationEngine.POST_MODES,
+                        help="turn post-processing: sync (inline), ordered "
+                             "(background, in order) or relaxed (background, "
+                             "superseded autosaves skipped)")
+    parser.add_argument("--mem-profile", type=int, default=0, metavar="N",
+                        help="log a memory event (RSS, buffer sizes, "
+                             "tracemalloc growth) every N turns")
+    parser.add_argument("--mem-alarm-mb", type=int, default=0,
+                        help="warn and log memory_alarm above this RSS")
+    parser.add_argument("--profile-turns", type=int, default=0, metavar="N",
+                        help="profile the first N turns (cProfile .prof + "
+                             ".folded stacks next to the log); SIGUSR1 "
+                             "profiles the next N (default 1) at any time")
+    parser.add_argument("--compact", type=float, nargs="?", const=0.8,
+                        default=None, metavar="THRESHOLD",
+                        help="drop older context lines whose shingle "
+                             "similarity to the newest thought reaches "
+                             "THRESHOLD (default 0.8); logged as compaction")
+    parser.add_argument("--compact-window", type=int, default=8,
+                        help="lines before the newest compared by --compact")
+    parser.add_argument("--no-library-tracking", action="store_true",
+                        help="do not diff haiku_library after tool-enabled "
+                             "turns (library_diff events)")
+    parser.add_argument("--headless", action="store_true",
+                        help="run --turns thoughts without the UI "
+                             "(Gradio is never imported), save, and exit")
+    parser.add_argument("--turns", type=int, default=None,
+                        help="turns for --headless (default 10; implies "
+                             "--headless)")
+    parser.add_argument("--bench-import", type=float, nargs="?",
+                        const=IMPORT_BUDGET_MS, default=None, metavar="MS",
+                        help="check the module import time against a "
+                             f"budget (default {IMPORT_BUDGET_MS} ms) "
+                             "and exit non-zero if over")
     args = parser.parse_args()
 
+    if args.bench_import is not None:
+        sys.exit(0 if bench_import(args.bench_import) else 1)
+    if args.analytics:
+        summaries, agg, recomputed = run_analytics(args.analytics)
+        print(f"[ContaminationEngine] {len(summaries)} runs "
+              f"({recomputed} re-read)")
+        print(format_analytics(agg))
+        return
+    if args.costs:
+        print(format_costs(load_ledgers(args.costs)))
+        return
+
+    _prepare_process()
+    RATE_LIMITER.enabled = not args.no_rate_limit
+    if args.rate_file:
+        RATE_LIMITER.path = args.rate_file
+    for spec in args.rate:
+        key, _, val = spec.partition("=")
+        rpm, _, burst = val.partition(":")
+        RATE_LIMITER.budgets[key] = (float(rpm),
+                                     float(burst or max(1.0, float(rpm) / 3)))
+
+    if args.migrate_sessions:
+        n = migrate_sessions("./sessions")
+        removed = line_store("./sessions").gc("./sessions")
+        print(f"[ContaminationEngine] Migrated {n} sessions, "
+              f"collected {removed} objects")
+        return
+
     mind = ContaminationEngine(model=args.model)
+    mind.hedge_enabled = args.hedge
+    mind.call_retries = args.retries
+    mind.adaptive_timeout = not args.fixed_timeout
+    mind.detox_batch_chars = args.detox_batch_chars
+    mind.search_enabled = args.search
+    mind.post_mode = args.post
+    mind.mem_profile_every = args.mem_profile
+    mind.mem_alarm_mb = args.mem_alarm_mb
+    mind.structured_output = not args.text_output
+    mind.library_tracking = not args.no_library_tracking
+    if args.compact is not None:
+        mind.compact_enabled = True
+        mind.compact_threshold = args.compact
+    mind.compact_window = args.compact_window
+    if args.profile_turns:
+        mind.request_profile(turns=args.profile_turns)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda *_: mind.request_profile(
+            turns=args.profile_turns or 1))
+    if args.rlimit_mem_mb:
+        mind.call_rlimits["memory_mb"] = args.rlimit_mem_mb
+    if args.rlimit_cpu_sec:
+        mind.call_rlimits["cpu_sec"] = args.rlimit_cpu_sec
+    if args.replay:
+        mind.cassette = Cassette(args.replay, "replay", args.replay_miss)
+    elif args.record:
+        mind.cassette = Cassette(args.record, "record")
+    if args.tournament:
+        data = load_session(args.tournament)
+        mind._set_context(data["context_lines"])
+        mind.thought_count = data.get("thought_count", 0)
+        rows = run_detox_tournament(
+            mind, methods=[m for m in args.methods.split(",") if m],
+            threshold=args.threshold, follow_up_turns=args.follow_up)
+        print(format_tournament_table(rows))
+        return
+    mind.book = args.book
     if args.experiment:
         mind.set_experiment(args.experiment)
+    if args.headless or args.turns is not None:
+        if not mind.start():
+            sys.exit(1)
+        for _ in range(10 if args.turns is None else args.turns):
+            mind.step()
+        mind.stop()
+        return
     app = create_ui(mind, lang=args.lang)
 
     if args.browser:
+        import webbrowser
         threading.Thread(
             target=lambda: (time.sleep(1),
                             webbrowser.open(f"http://localhost:{args.port}")),